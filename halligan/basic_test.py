@@ -1,4 +1,5 @@
 import os
+import glob
 from difflib import SequenceMatcher
 
 import pytest
@@ -115,4 +116,161 @@ def test_halligan():
     assert segmenter is not None, "Failed to initialize Segmenter (FastSAM)"
 
     detector = Detector()
-    assert detector is not None, "Failed to initialize Detector (DINOv2)"
\ No newline at end of file
+    assert detector is not None, "Failed to initialize Detector (DINOv2)"
+
+
+def test_get_frames():
+    """
+    Verify that frame extraction fills holes exactly like `scipy.ndimage.binary_fill_holes`
+    on all example frames.
+    """
+    from benchmark_frames import benchmark
+
+    paths = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "examples", "*", "frame_*.png")))
+    assert paths, "No example frames found"
+    benchmark(paths, repeat=1)
+
+
+def test_empty_segmentation(tmp_path, monkeypatch):
+    """
+    Verify that a frame without segments is stored in and loaded from the segment cache,
+    and that element queries then fall back to the whole frame.
+    """
+    import PIL.Image
+    from halligan.utils import layout
+    from halligan.utils.cache import DiskCache
+
+    class EmptySegmenter:
+        @staticmethod
+        def segment(image):
+            return [], [], []
+
+    monkeypatch.setattr(layout, "Segmenter", EmptySegmenter)
+    monkeypatch.setattr(layout, "segment_cache", DiskCache(str(tmp_path)))
+
+    # The first frame stores the empty segmentation, the second loads it
+    image = PIL.Image.new("RGB", (64, 64), "white")
+    for _ in range(2):
+        frame = layout.Frame(10, 20, image)
+        element = frame.get_element("up", "a red button")
+        assert element.bbox == frame.bbox
+
+    assert layout.segment_cache.hits == 1
+
+
+def test_ask_image_index(monkeypatch):
+    """
+    Verify that `ask` answers naming an image by position refer to the original images,
+    also when a duplicate comes before the answered image.
+    """
+    import PIL.Image
+    from halligan.utils import vision_tools
+
+    blue = PIL.Image.new("RGB", (32, 32), "blue")
+
+    def agent_pool(prompt, images, image_captions):
+        index = next(i for i, image in enumerate(images) if image.tobytes() == blue.tobytes())
+        return f"answer(numbers=[{index}])", {}
+
+    monkeypatch.setattr(vision_tools, "agent_pool", agent_pool)
+
+    red = PIL.Image.new("RGB", (32, 32), "red")
+    green = PIL.Image.new("RGB", (32, 32), "green")
+    assert vision_tools.ask([red, red.copy(), green, blue], "Which image is blue?", "int") == [3]
+
+
+def test_quantile():
+    """
+    Verify that exported quantiles are nearest-rank, also for small odd-length inputs.
+    """
+    from halligan.utils.metrics import quantile
+
+    assert quantile([1, 2, 3, 4, 5], 0.5) == 3
+    assert quantile(list(range(1, 10)), 0.5) == 5
+    assert quantile(list(range(1, 31)), 0.95) == 29
+    assert quantile([7], 0.99) == 7
+
+
+def test_batch_single_request(monkeypatch):
+    """
+    Verify that a `batch()` of several questions is answered with a single request.
+    """
+    import threading
+    import PIL.Image
+    from halligan.agents import AgentPool
+    from halligan.utils import vision_tools
+    from mock_server import MockServer
+
+    server = MockServer(("127.0.0.1", 0), seed=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    monkeypatch.setattr(vision_tools, "agent_pool", AgentPool(api_key="mock", base_url=base_url))
+
+    colors = ["red", "green", "blue", "yellow"]
+    try:
+        with vision_tools.batch():
+            answers = [
+                vision_tools.ask([PIL.Image.new("RGB", (32, 32), color) for color in colors[:n]], f"Question {n}?", "bool")
+                for n in range(1, len(colors) + 1)
+            ]
+    finally:
+        server.shutdown()
+
+    assert [len(answer) for answer in answers] == [1, 2, 3, 4]
+    assert server.requests == 1
+
+
+def test_explore_keeps_observation():
+    """
+    Verify that exploring swaps leaves the grid frame and its elements as they are.
+    """
+    import numpy as np
+    import PIL.Image
+    from halligan.utils.layout import Frame, Element
+    from halligan.utils.action_tools import explore
+
+    # Four distinct noise tiles in a 2 x 2 grid
+    rng = np.random.default_rng(0)
+    image = PIL.Image.fromarray(rng.integers(0, 256, (64, 64, 3), dtype=np.uint8))
+
+    grid = Frame(0, 0, image)
+    corners = [(0, 0), (32, 0), (0, 32), (32, 32)]
+    elements = [Element(x, y, image.crop((x, y, x + 32, y + 32)), grid) for x, y in corners]
+    for element in elements:
+        element.set_element_as("SWAPPABLE")
+    revision = grid._revision
+
+    choices = explore(grid)
+    assert len(choices) == 6
+    assert grid._revision == revision
+    assert [element.image.getpixel((0, 0)) for element in elements] == [image.getpixel(corner) for corner in corners]
+
+
+def test_stream_stop():
+    """
+    Verify that a streamed reply is only cut short when text follows the code block,
+    and that a reply ending with the block keeps its usage.
+    """
+    from types import SimpleNamespace
+    from halligan.agents.agent import _Stream
+
+    def chunk(content=None, finish_reason=None, usage=None):
+        choices = [] if usage else [SimpleNamespace(delta=SimpleNamespace(content=content), finish_reason=finish_reason)]
+        return SimpleNamespace(system_fingerprint="fp", usage=usage, choices=choices)
+
+    usage = SimpleNamespace(total_tokens=3, prompt_tokens=2, completion_tokens=1)
+    block = ["```python\n", "def solve(frames):\n", "    pass\n", "```"]
+
+    # The block closes the reply, the stream is read to the usage chunk
+    stream = _Stream("solve")
+    chunks = [chunk(piece) for piece in block] + [chunk("", "stop"), chunk(usage=usage)]
+    assert not any(stream.add(c) for c in chunks)
+    assert stream.content == "".join(block)
+    assert stream.metadata()["total_tokens"] == 3 and not stream.metadata()["stopped_early"]
+
+    # Text after the block is cut off
+    stream = _Stream("solve")
+    chunks = [chunk(piece) for piece in block] + [chunk("\nThis script")]
+    assert [stream.add(c) for c in chunks] == [False] * len(block) + [True]
+    assert stream.content == "".join(block)
+    assert stream.metadata()["stopped_early"] and stream.metadata()["total_tokens"] is None
@@ -0,0 +1,113 @@
+"""
+Micro-benchmark of frame extraction (`layout.get_frames`) over the example frames.
+
+Checks that the OpenCV hole filling used by `get_frames` matches `scipy.ndimage.binary_fill_holes`
+on the binarized examples, then reports the time of both and of `get_frames` itself.
+
+Also times `Point.show_neighbours` at random points of each frame against segmenting every
+neighbourhood on its own, and how often the fine superpixel level falls back to that.
+
+Usage:
+    python benchmark_frames.py --examples ../examples --repeat 5 --points 10
+"""
+import os
+import glob
+import argparse
+from timeit import default_timer as timer
+
+import cv2
+import numpy as np
+import PIL.Image
+from scipy.ndimage import binary_fill_holes
+from skimage.segmentation import slic
+
+from halligan.utils.layout import Frame, Point, NEIGHBOURS, get_frames, _fill_holes, _superpixel_stats
+
+
+def binarize(image: PIL.Image.Image) -> np.ndarray:
+    np_image = cv2.cvtColor(np.array(image.convert("RGB")), cv2.COLOR_RGB2GRAY)
+    np_image = cv2.adaptiveThreshold(np_image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+    return cv2.bitwise_not(np_image)
+
+
+def benchmark(paths: list[str], repeat: int) -> dict[str, float]:
+    """
+    Returns the total seconds spent per operation, averaged over `repeat` runs.
+    Raises an AssertionError if hole filling differs from scipy on any example.
+    """
+    timings = {"get_frames": 0.0, "fill_holes": 0.0, "binary_fill_holes": 0.0}
+
+    for path in paths:
+        image = PIL.Image.open(path)
+        image.load()
+        mask = binarize(image)
+
+        expected = binary_fill_holes(mask).astype(np.uint8) * 255
+        assert np.array_equal(_fill_holes(mask), expected), f"Hole filling differs on {path}"
+
+        for _ in range(repeat):
+            start_time = timer()
+            get_frames(0, 0, image)
+            timings["get_frames"] += (timer() - start_time) / repeat
+
+            start_time = timer()
+            _fill_holes(mask)
+            timings["fill_holes"] += (timer() - start_time) / repeat
+
+            start_time = timer()
+            binary_fill_holes(mask)
+            timings["binary_fill_holes"] += (timer() - start_time) / repeat
+
+    return timings
+
+
+def benchmark_neighbours(paths: list[str], points: int, seed: int = 0) -> tuple[dict[str, float], int]:
+    """
+    Returns the total seconds spent on `points` neighbourhoods per frame, by `Point.show_neighbours`
+    and by segmenting each window on its own, and the number of windows that fell back to the latter.
+    """
+    rng = np.random.default_rng(seed)
+    timings = {"show_neighbours": 0.0, "window_slic": 0.0}
+    fallbacks = 0
+
+    for path in paths:
+        image = PIL.Image.open(path).convert("RGBA")
+        xy = [(int(rng.integers(image.width)), int(rng.integers(image.height))) for _ in range(points)]
+
+        frame = Frame(0, 0, image)
+        start_time = timer()
+        for x, y in xy:
+            Point(x, y, frame).show_neighbours()
+        timings["show_neighbours"] += timer() - start_time
+        fallbacks += len(frame._neighbourhoods)
+
+        pixels = np.array(image.convert("RGB"))
+        start_time = timer()
+        for x, y in xy:
+            xmin, ymin = max(0, x - 100), max(0, y - 100)
+            xmax, ymax = min(image.width, x + 100), min(image.height, y + 100)
+            _superpixel_stats(slic(pixels[ymin:ymax, xmin:xmax], n_segments=NEIGHBOURS, compactness=10))
+        timings["window_slic"] += timer() - start_time
+
+    return timings, fallbacks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark frame extraction on the example frames.")
+    parser.add_argument("--examples", default=os.path.join(os.path.dirname(__file__), "..", "examples"))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--points", type=int, default=10, help="Random points per frame for show_neighbours")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.examples, "*", "frame_*.png")))
+    timings = benchmark(paths, args.repeat)
+
+    print(f"{len(paths)} frames, {args.repeat} runs each (hole filling matches scipy on all frames)")
+    for name, seconds in timings.items():
+        print(f"{name:>20}: {seconds * 1000:8.1f} ms total, {seconds / len(paths) * 1000:6.2f} ms per frame")
+
+    timings, fallbacks = benchmark_neighbours(paths, args.points)
+    calls = len(paths) * args.points
+    print(f"{calls} neighbourhoods, {fallbacks} segmented on their own")
+    for name, seconds in timings.items():
+        print(f"{name:>20}: {seconds * 1000:8.1f} ms total, {seconds / calls * 1000:6.2f} ms per point")
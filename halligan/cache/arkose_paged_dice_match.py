@@ -1,4 +1,4 @@
-from halligan.utils.vision_tools import ask, focus
+from halligan.utils.vision_tools import ask, ask_many, focus
 from halligan.utils.action_tools import get_all_choices, click
 
 
@@ -13,8 +13,10 @@ def stage2(frames):
 
     # Frame 1: Dice with arrows
     frame_1 = frames[1]
-    left_arrow = frame_1.get_element(position="left", details="black circle with left arrow")
-    right_arrow = frame_1.get_element(position="right", details="black circle with right arrow")
+    left_arrow, right_arrow = frame_1.get_elements([
+        ("left", "black circle with left arrow"),
+        ("right", "black circle with right arrow")
+    ])
     left_arrow.set_element_as(interactable="CLICKABLE")
     right_arrow.set_element_as(interactable="CLICKABLE")
 
@@ -41,12 +43,13 @@ def stage3(frames):
     best_choice = None
     best_difference = float('inf')
 
-    # Iterate through each choice to find the closest sum to the target number
-    for choice in choices:
-        # Focus on the dice in the current choice
-        dice_patches = focus(choice.image, "dice")
-        dice_numbers = ask(dice_patches, "What is the die number?", answer_type="int")
-        dice_sum = sum(dice_numbers)
+    # Ask about the dice of every choice together in one batched request
+    dice_patches = [focus(choice.image, "dice") for choice in choices]
+    dice_numbers = ask_many([(patches, "What is the die number?", "int") for patches in dice_patches])
+
+    # Find the choice with the closest sum to the target number
+    for choice, numbers in zip(choices, dice_numbers):
+        dice_sum = sum(numbers)
 
         # Calculate the difference from the target
         difference = abs(target_number - dice_sum)
@@ -5,16 +5,19 @@ import traceback
 import importlib.util
 from io import BytesIO
 from datetime import datetime
+from timeit import default_timer as timer
 
 from PIL import Image
 from dotenv import load_dotenv
 from playwright.sync_api import sync_playwright, Page
 
 import halligan.utils.action_tools as action_tools
+import halligan.utils.vision_tools as vision_tools
 from samples import SAMPLES
-from halligan.agents import GPTAgent
+from halligan.agents import GPTAgent, ResponseCache, RetryPolicy
 from halligan.utils.logger import Trace
-from halligan.utils.layout import get_frames, get_observation
+from halligan.utils.metrics import Metrics
+from halligan.utils.layout import get_frames, get_observation, segment_cache
 from halligan.stages.stage1 import objective_identification
 from halligan.stages.stage2 import structure_abstraction
 from halligan.stages.stage3 import solution_composition
@@ -42,6 +45,15 @@ CACHE_PATH = os.path.join(BASE_PATH, "cache")
 BROWSER_URL = os.getenv("BROWSER_URL")
 BENCHMARK_URL = os.getenv("BENCHMARK_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+VLM_CACHE_BYPASS = os.getenv("VLM_CACHE_BYPASS") == "1"
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_PATH = os.path.join(BASE_PATH, "results", "metrics.prom")
+
+response_cache = ResponseCache(bypass=VLM_CACHE_BYPASS)
+retry_policy = RetryPolicy.from_env()
+vision_tools.agent_pool.cache = response_cache
+
+if METRICS_PORT: Metrics.serve(int(METRICS_PORT))
 
 
 def prepare_captcha(captcha_type: str, page: Page):
@@ -67,7 +79,7 @@ def prepare_captcha(captcha_type: str, page: Page):
 
 def solve_captcha(captcha_type: str, id: int, region: dict) -> bool:
     # Load agent
-    agent = GPTAgent(api_key=OPENAI_API_KEY)
+    agent = GPTAgent(api_key=OPENAI_API_KEY, cache=response_cache, retry=retry_policy)
 
     # Load generated solution script from cache
     cache_file = os.path.join(CACHE_PATH, f"{captcha_type.replace("/", "_")}.py")
@@ -77,6 +89,7 @@ def solve_captcha(captcha_type: str, id: int, region: dict) -> bool:
     spec.loader.exec_module(cache)
 
     solved = False
+    Metrics.start(captcha=captcha_type)
     with sync_playwright() as p:
         browser = p.chromium.connect(BROWSER_URL)
         context = browser.new_context(viewport={"width": 1344, "height": 768})
@@ -97,12 +110,15 @@ def solve_captcha(captcha_type: str, id: int, region: dict) -> bool:
             Trace.start(captcha, trace_path)
 
             @Trace.section("Objective Identification")
+            @Metrics.timed("halligan_stage_seconds", stage="objective_identification")
             def stage1(frames): return cache.stage1(frames)
 
             @Trace.section("Structure Abstraction")
+            @Metrics.timed("halligan_stage_seconds", stage="structure_abstraction")
             def stage2(frames): return cache.stage2(frames)
 
             @Trace.section("Solution Composition")
+            @Metrics.timed("halligan_stage_seconds", stage="solution_composition")
             def stage3(frames): return cache.stage3(frames)
 
             frames = get_frames(x, y, captcha)
@@ -154,5 +170,12 @@ for i, (captcha_type, sample_info) in enumerate(SAMPLES.items()):
     sample_region = sample_info["region"]
     sample_x = sample_region["x"]
     sample_y = sample_region["y"]
+    start_time = timer()
     solved = solve_captcha(captcha_type, sample_id, sample_region)
-    logger.info(f"Solved: {solved}")
\ No newline at end of file
+    Metrics.observe("halligan_episode_seconds", timer() - start_time)
+    Metrics.increment("halligan_episodes_total", solved=str(solved).lower())
+    Metrics.write(METRICS_PATH)
+    logger.info(f"Solved: {solved}")
+    logger.info(f"Response cache: {response_cache.hits} hits, {response_cache.misses} misses")
+    logger.info(f"Segment cache: {segment_cache.hits} hits, {segment_cache.misses} misses")
+    logger.info(f"Detection cache: {vision_tools.detection_cache.hits} hits, {vision_tools.detection_cache.misses} misses")
\ No newline at end of file
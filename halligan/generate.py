@@ -6,18 +6,21 @@ import importlib.util
 from io import BytesIO
 from textwrap import indent
 from datetime import datetime
+from timeit import default_timer as timer
 
 from PIL import Image
 from dotenv import load_dotenv
 from playwright.sync_api import sync_playwright, Page
 
 import halligan.utils.action_tools as action_tools
+import halligan.utils.vision_tools as vision_tools
 import halligan.utils.examples as Examples
 import halligan.prompts as Prompts
 
 from samples import SAMPLES
-from halligan.agents import GPTAgent
+from halligan.agents import GPTAgent, ResponseCache, RetryPolicy
 from halligan.utils.logger import Trace
+from halligan.utils.metrics import Metrics
 from halligan.agents import Agent
 from halligan.utils.constants import Stage, InteractableElement
 from halligan.utils.action_tools import action_toolkits
@@ -50,6 +53,15 @@ CACHE_PATH = os.path.join(BASE_PATH, "cache")
 BROWSER_URL = os.getenv("BROWSER_URL")
 BENCHMARK_URL = os.getenv("BENCHMARK_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+VLM_CACHE_BYPASS = os.getenv("VLM_CACHE_BYPASS") == "1"
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_PATH = os.path.join(BASE_PATH, "results", "metrics.prom")
+
+response_cache = ResponseCache(bypass=VLM_CACHE_BYPASS)
+retry_policy = RetryPolicy.from_env()
+vision_tools.agent_pool.cache = response_cache
+
+if METRICS_PORT: Metrics.serve(int(METRICS_PORT))
 
 
 def prepare_captcha(captcha_type: str, page: Page):
@@ -74,6 +86,7 @@ def prepare_captcha(captcha_type: str, page: Page):
 
 
 @Trace.section("Solution Composition")
+@Metrics.timed("halligan_stage_seconds", stage="solution_composition")
 def solution_composition(agent: Agent, frames: list[Frame], objective: str) -> None: 
     """
     Agent composes a Python executable solution using vision and action tools.
@@ -110,13 +123,13 @@ def solution_composition(agent: Agent, frames: list[Frame], objective: str) -> N
     )
 
     # Request script from agent 
-    agent(prompt, images, image_captions)
+    agent(prompt, images, image_captions, stop_after="solve")
     agent.reset()
 
     
 def generate_script(captcha_type: str, id: int, region: dict):
     # Load agent
-    agent = GPTAgent(api_key=OPENAI_API_KEY)
+    agent = GPTAgent(api_key=OPENAI_API_KEY, cache=response_cache, retry=retry_policy)
 
     # Load generated solution script from cache
     cache_file = os.path.join(CACHE_PATH, f"{captcha_type.replace("/", "_")}.py")
@@ -125,6 +138,7 @@ def generate_script(captcha_type: str, id: int, region: dict):
     sys.modules[captcha_type] = cache
     spec.loader.exec_module(cache)
 
+    Metrics.start(captcha=captcha_type)
     with sync_playwright() as p:
         browser = p.chromium.connect(BROWSER_URL)
         context = browser.new_context(viewport={"width": 1344, "height": 768})
@@ -170,4 +184,8 @@ for i, (captcha_type, sample_info) in enumerate(SAMPLES.items()):
     sample_region = sample_info["region"]
     sample_x = sample_region["x"]
     sample_y = sample_region["y"]
-    generate_script(captcha_type, sample_id, sample_region)
\ No newline at end of file
+    start_time = timer()
+    generate_script(captcha_type, sample_id, sample_region)
+    Metrics.observe("halligan_episode_seconds", timer() - start_time)
+    Metrics.write(METRICS_PATH)
+    logger.info(f"Response cache: {response_cache.hits} hits, {response_cache.misses} misses")
\ No newline at end of file
@@ -1 +1,5 @@
-from .agent import Agent, GPTAgent
\ No newline at end of file
+from .agent import Agent, GPTAgent, AsyncGPTAgent
+from .cache import ResponseCache
+from .history import HistoryPolicy
+from .retry import RetryPolicy
+from .pool import AgentPool
\ No newline at end of file
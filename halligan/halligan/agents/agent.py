@@ -1,23 +1,35 @@
-import io
-import base64
+import re
+import copy
+import asyncio
+import threading
+from timeit import default_timer as timer
 from abc import ABC, abstractmethod
-from typing import Optional, TypeAlias, Any
+from typing import Optional, TypeAlias, Any, Coroutine
 
 import openai
 from PIL import Image
 
 from halligan.utils.logger import Trace
+from halligan.utils.metrics import Metrics
+from halligan.utils.encoding import ImageEncoder, default_encoder
+from halligan.agents.cache import ResponseCache
+from halligan.agents.history import HistoryPolicy
+from halligan.agents.retry import RetryPolicy
 
 
 Metadata: TypeAlias = dict[str, Any]
 
 
 class Agent(ABC):
+    # Compaction applied to the history sent with each request, if any
+    history_policy: Optional[HistoryPolicy] = None
+
     @abstractmethod
     def __call__(
         self, 
         prompt: str, images: Optional[list[Image.Image]] = None, 
-        image_captions: Optional[list[str]] = None
+        image_captions: Optional[list[str]] = None,
+        stop_after: Optional[str] = None
     ) -> tuple[str, str]:
         pass
 
@@ -26,57 +38,327 @@ class Agent(ABC):
         pass
 
 
+def _user_message(
+    prompt: str, 
+    images: list[Image.Image], 
+    image_captions: list[str],
+    encoder: ImageEncoder
+) -> dict:
+    """
+    Build a user message from a prompt and a list of captioned images.
+    """
+    user_prompt = [{"type": "text", "text": prompt}]
+
+    for image_url, image_caption in zip(encoder.encode_all(images), image_captions):
+        user_prompt.append({
+            "type": "text",
+            "text": image_caption
+        })
+        user_prompt.append({
+            "type": "image_url",
+            "image_url": {"url": image_url}
+        })
+
+    return {"role": "user", "content": user_prompt}
+
+
+def _request(model: str, messages: list[dict]) -> dict[str, Any]:
+    """
+    Chat completion parameters, also used as the response cache key.
+    """
+    return {
+        "model": model,
+        "messages": messages,
+        "max_tokens": 1024,
+        "temperature": 0,
+        "top_p": 1
+    }
+
+
+def _metadata(response) -> Metadata:
+    return {
+        "fingerprint": response.system_fingerprint,
+        "total_tokens": response.usage.total_tokens,
+        "prompt_tokens": response.usage.prompt_tokens,
+        "completion_tokens": response.usage.completion_tokens
+    }
+
+
+def _block_end(content: str, name: str) -> Optional[int]:
+    """
+    End of the closed ```python block that defines function `name`, None if there is none yet.
+    """
+    for match in re.finditer(r"```python(.*?)```", content, re.DOTALL):
+        if re.search(rf"^\s*def {name}\s*\(", match.group(1), re.MULTILINE):
+            return match.end()
+    return None
+
+
+class _Stream:
+    def __init__(self, stop_after: str) -> None:
+        """
+        Collects a streamed completion until the ```python block defining `stop_after` is closed.
+        """
+        self.stop_after = stop_after
+        self.content = ""
+        self.fingerprint = None
+        self.usage = None
+        self.stopped_early = False
+        # End of the closed block in `content`, once it arrived
+        self.end = None
+
+    def add(self, chunk) -> bool:
+        """
+        Add a chunk, returns True once the rest of the stream is not needed.
+        """
+        self.fingerprint = chunk.system_fingerprint or self.fingerprint
+        if chunk.usage: self.usage = chunk.usage
+        if not chunk.choices: return False
+
+        delta = chunk.choices[0].delta.content or ""
+        self.content += delta
+        # Fences can be split across chunks, only search once a backtick arrives
+        if self.end is None and "`" in delta:
+            self.end = _block_end(self.content, self.stop_after)
+        if self.end is None: return False
+
+        # Cut the stream only once text follows the block, a block that ends the reply
+        # is read to the end so the usage chunk still arrives
+        cut_off = self.end < len(self.content) and chunk.choices[0].finish_reason is None
+        self.content = self.content[:self.end]
+        self.stopped_early = cut_off
+        return cut_off
+
+    def metadata(self) -> Metadata:
+        # Usage is only sent with the final chunk, it is unknown if the stream was cut short
+        return {
+            "fingerprint": self.fingerprint,
+            "total_tokens": self.usage.total_tokens if self.usage else None,
+            "prompt_tokens": self.usage.prompt_tokens if self.usage else None,
+            "completion_tokens": self.usage.completion_tokens if self.usage else None,
+            "streamed": True,
+            "stopped_early": self.stopped_early
+        }
+
+
+def _record(model: str, metadata: Metadata, cached: bool) -> None:
+    Metrics.increment("halligan_vlm_requests_total", model=model, cached=str(cached).lower())
+    if cached: return
+    if metadata.get("stopped_early"): Metrics.increment("halligan_vlm_early_stops_total", model=model)
+    if metadata["prompt_tokens"] is None: return
+    Metrics.increment("halligan_vlm_tokens_total", metadata["prompt_tokens"], model=model, kind="prompt")
+    Metrics.increment("halligan_vlm_tokens_total", metadata["completion_tokens"], model=model, kind="completion")
+
+
 class GPTAgent(Agent):
-    def __init__(self, api_key: str, model: str = "gpt-4o-2024-11-20") -> None:
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "gpt-4o-2024-11-20",
+        cache: Optional[ResponseCache] = None,
+        encoder: ImageEncoder = default_encoder,
+        base_url: Optional[str] = None,
+        retry: Optional[RetryPolicy] = None
+    ) -> None:
+        """
+        `base_url` points the agent at any OpenAI-compatible server (e.g. mock_server.py).
+        Defaults to the OPENAI_BASE_URL environment variable, then the OpenAI API.
+        `retry` controls timeouts, retries and hedging of requests, see RetryPolicy.
+        """
         self.model = model
-        self.client = openai.OpenAI(api_key=api_key, timeout=30)
+        self.retry = retry or RetryPolicy()
+        self.client = openai.OpenAI(api_key=api_key, base_url=base_url, timeout=self.retry.timeout, max_retries=0)
+        self.cache = cache
+        self.encoder = encoder
         self.history = []
 
     def reset(self):
         self.history = []
- 
+
+    def _complete(self, request: dict[str, Any], stop_after: Optional[str]) -> tuple[str, Metadata]:
+        if not stop_after:
+            response = self.client.chat.completions.create(**request)
+            return response.choices[0].message.content, _metadata(response)
+
+        stream = _Stream(stop_after)
+        with self.client.chat.completions.create(
+            **request, stream=True, stream_options={"include_usage": True}
+        ) as chunks:
+            for chunk in chunks:
+                if stream.add(chunk): break
+
+        return stream.content, stream.metadata()
+
     @Trace.agent()
     def __call__(
-        self, 
-        prompt: str, 
+        self,
+        prompt: str,
         images: Optional[list[Image.Image]] = [],
-        image_captions: Optional[list[str]] = []
+        image_captions: Optional[list[str]] = [],
+        stop_after: Optional[str] = None
     ) -> tuple[str, Metadata]:
-        user_prompt = [{"type": "text", "text": prompt}]
-        
-        for image, image_caption in zip(images, image_captions):
-            bytes = io.BytesIO()
-            image.save(bytes, format="JPEG")
-            image_b64 = base64.b64encode(bytes.getvalue()).decode('ascii')
-            user_prompt.append({
-                "type": "text",
-                "text": image_caption
-            })
-            user_prompt.append({
-                "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"}
-            })
-
-        self.history.append({"role": "user", "content": user_prompt})
-
-        print("history:", len(self.history))
-
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=self.history,
-            max_tokens=1024,
-            temperature=0,
-            top_p=1
-        )
-
-        content = response.choices[0].message.content
-        metadata = {
-            "fingerprint": response.system_fingerprint,
-            "total_tokens": response.usage.total_tokens,
-            "prompt_tokens": response.usage.prompt_tokens,
-            "completion_tokens": response.usage.completion_tokens
-        }
+        """
+        `stop_after`: name of a function, if given the completion is streamed and stops
+            as soon as the ```python block defining it is closed (the rest is not generated).
+        """
+        message = _user_message(prompt, images, image_captions, self.encoder)
+        history = self.history + [message]
+
+        print("history:", len(history))
+
+        messages = self.history_policy.compact(history) if self.history_policy else history
+        request = _request(self.model, messages)
+        key = {**request, "stop_after": stop_after} if stop_after else request
+        cached = self.cache.get(key) if self.cache else None
+
+        if cached:
+            content, metadata = cached
+        else:
+            start_time = timer()
+            content, metadata = self.retry.call(lambda: self._complete(request, stop_after))
+            Metrics.observe("halligan_vlm_request_seconds", timer() - start_time, model=self.model)
+            if self.cache: self.cache.put(key, content, metadata)
+
+        _record(self.model, metadata, cached=bool(cached))
+
+        # Only completed turns are kept, failed or cancelled requests leave the history untouched
+        self.history.extend([message, {"role": "assistant", "content": content}])
+
+        return content, metadata
+
+
+class _RequestPool:
+    def __init__(self, api_key: str, base_url: Optional[str], max_concurrency: int, timeout: float) -> None:
+        """
+        Runs an event loop on a daemon thread that owns the async client.
+        All requests go through this loop, at most `max_concurrency` at a time.
+        """
+        self.loop = asyncio.new_event_loop()
+        self.client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    def run(self, coroutine: Coroutine) -> Any:
+        """
+        Run a coroutine on the pool loop and block until it completes.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def submit(self, coroutine: Coroutine) -> Any:
+        """
+        Await a coroutine on the pool loop from any running event loop.
+        """
+        if asyncio.get_running_loop() is self.loop:
+            return await coroutine
+
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        return await asyncio.wrap_future(future)
+
+
+class AsyncGPTAgent(Agent):
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "gpt-4o-2024-11-20",
+        max_concurrency: int = 4,
+        cache: Optional[ResponseCache] = None,
+        encoder: ImageEncoder = default_encoder,
+        base_url: Optional[str] = None,
+        retry: Optional[RetryPolicy] = None
+    ) -> None:
+        """
+        GPTAgent backed by `openai.AsyncOpenAI`.
+        Forked agents share the same request pool, so independent calls can overlap
+        while the number of requests in flight stays bounded by `max_concurrency`.
+        A hedged request holds a single slot for both of its attempts.
+        """
+        self.model = model
+        self.retry = retry or RetryPolicy()
+        self.pool = _RequestPool(api_key, base_url, max_concurrency, self.retry.timeout)
+        self.cache = cache
+        self.encoder = encoder
+        self.history = []
+
+    def reset(self):
+        self.history = []
+
+    def fork(self) -> "AsyncGPTAgent":
+        """
+        Create an agent with an empty history that shares this agent's request pool.
+        """
+        agent = copy.copy(self)
+        agent.history = []
+        return agent
+
+    async def _create(self, request: dict[str, Any], stop_after: Optional[str]) -> tuple[str, Metadata]:
+        if not stop_after:
+            response = await self.pool.client.chat.completions.create(**request)
+            return response.choices[0].message.content, _metadata(response)
+
+        stream = _Stream(stop_after)
+        async with await self.pool.client.chat.completions.create(
+            **request, stream=True, stream_options={"include_usage": True}
+        ) as chunks:
+            async for chunk in chunks:
+                if stream.add(chunk): break
+
+        return stream.content, stream.metadata()
+
+    async def _complete(self, request: dict[str, Any], stop_after: Optional[str]) -> tuple[str, Metadata]:
+        async with self.pool.semaphore:
+            start_time = timer()
+            result = await self.retry.acall(lambda: self._create(request, stop_after))
+            Metrics.observe("halligan_vlm_request_seconds", timer() - start_time, model=self.model)
+            return result
+
+    @Trace.agent()
+    async def acall(
+        self,
+        prompt: str,
+        images: Optional[list[Image.Image]] = [],
+        image_captions: Optional[list[str]] = [],
+        stop_after: Optional[str] = None
+    ) -> tuple[str, Metadata]:
+        """
+        `stop_after`: see GPTAgent.
+        """
+        # Encode off the event loop so concurrent requests are not blocked
+        message = await asyncio.to_thread(_user_message, prompt, images, image_captions, self.encoder)
+        history = self.history + [message]
+
+        messages = self.history_policy.compact(history) if self.history_policy else history
+        request = _request(self.model, messages)
+        key = {**request, "stop_after": stop_after} if stop_after else request
+        cached = self.cache.get(key) if self.cache else None
+
+        if cached:
+            content, metadata = cached
+        else:
+            content, metadata = await self.pool.submit(self._complete(request, stop_after))
+            if self.cache: self.cache.put(key, content, metadata)
+
+        _record(self.model, metadata, cached=bool(cached))
+
+        # Only completed turns are kept, failed or cancelled requests leave the history untouched
+        self.history.extend([message, {"role": "assistant", "content": content}])
+
+        return content, metadata
+
+    def __call__(
+        self,
+        prompt: str,
+        images: Optional[list[Image.Image]] = [],
+        image_captions: Optional[list[str]] = [],
+        stop_after: Optional[str] = None
+    ) -> tuple[str, Metadata]:
+        return self.pool.run(self.acall(prompt, images, image_captions, stop_after=stop_after))
+
+    def map(self, calls: list[tuple[str, list[Image.Image], list[str]]]) -> list[tuple[str, Metadata]]:
+        """
+        Send independent (prompt, images, image_captions) requests concurrently.
+        Each request is made by a forked agent, results are returned in order.
+        """
+        async def gather():
+            return await asyncio.gather(*(self.fork().acall(*call) for call in calls))
 
-        self.history.append({"role": "assistant", "content": content})
-        
-        return content, metadata
\ No newline at end of file
+        return self.pool.run(gather())
@@ -0,0 +1,49 @@
+import os
+import json
+import hashlib
+from typing import Optional, Any
+
+from halligan.utils.cache import CACHE_DIR, DiskCache
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        path: str = os.path.join(CACHE_DIR, "responses"),
+        max_bytes: int = 1 << 30,
+        bypass: bool = False
+    ) -> None:
+        """
+        Caches agent responses on disk, keyed by a hash of the full request
+        (model, message history including image bytes, and sampling parameters).
+        With `bypass`, lookups always miss but fresh responses are still stored.
+        """
+        self.store = DiskCache(path, max_bytes)
+        self.bypass = bypass
+
+    @property
+    def hits(self) -> int:
+        return self.store.hits
+
+    @property
+    def misses(self) -> int:
+        return self.store.misses
+
+    def key(self, request: dict[str, Any]) -> str:
+        payload = json.dumps(request, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, request: dict[str, Any]) -> Optional[tuple[str, dict[str, Any]]]:
+        if self.bypass:
+            self.store.misses += 1
+            return None
+
+        value = self.store.get(self.key(request))
+        if value is None: return None
+
+        entry = json.loads(value)
+        return entry["content"], {**entry["metadata"], "cached": True}
+
+    def put(self, request: dict[str, Any], content: str, metadata: dict[str, Any]) -> None:
+        value = json.dumps({"content": content, "metadata": metadata})
+        self.store.put(self.key(request), value.encode("utf-8"))
@@ -0,0 +1,73 @@
+from typing import Optional
+
+
+# Rough cost of one image in a request (a high detail 1024 x 1024 image).
+IMAGE_TOKENS = 765
+
+IMAGE_STAND_IN = {"type": "text", "text": "[image omitted]"}
+
+
+def estimate_tokens(messages: list[dict]) -> int:
+    """
+    Estimate the prompt tokens of a conversation, about 4 characters per token.
+    """
+    tokens = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            tokens += len(content) // 4
+            continue
+
+        for part in content:
+            if part["type"] == "image_url": tokens += IMAGE_TOKENS
+            else: tokens += len(part["text"]) // 4
+
+    return tokens
+
+
+def _has_images(message: dict) -> bool:
+    return not isinstance(message["content"], str) and any(part["type"] == "image_url" for part in message["content"])
+
+
+def _strip_images(message: dict) -> dict:
+    content = [IMAGE_STAND_IN if part["type"] == "image_url" else part for part in message["content"]]
+    return {**message, "content": content}
+
+
+class HistoryPolicy:
+    def __init__(self, max_image_turns: Optional[int] = None, token_budget: Optional[int] = None) -> None:
+        """
+        Controls how much of the conversation history is resent with each request.
+        `max_image_turns`: only the latest N user turns keep their images,
+            images in earlier turns are replaced with short textual stand-ins.
+        `token_budget`: replace images (oldest first), then drop the oldest turns,
+            until the estimated prompt tokens fit the budget.
+        The first turn (task prompt), the latest reply and the latest turn are never dropped.
+        The agent history itself is left untouched, only the request is compacted.
+        """
+        self.max_image_turns = max_image_turns
+        self.token_budget = token_budget
+
+    def compact(self, messages: list[dict]) -> list[dict]:
+        messages = list(messages)
+        user_turns = [i for i, message in enumerate(messages) if message["role"] == "user"]
+
+        if self.max_image_turns is not None:
+            keep = user_turns[-self.max_image_turns:] if self.max_image_turns > 0 else []
+            for i in user_turns:
+                if i not in keep and _has_images(messages[i]):
+                    messages[i] = _strip_images(messages[i])
+
+        if self.token_budget is None:
+            return messages
+
+        for i in user_turns[:-1]:
+            if estimate_tokens(messages) <= self.token_budget: return messages
+            if _has_images(messages[i]): messages[i] = _strip_images(messages[i])
+
+        # Drop whole turns after the task prompt, oldest first: an assistant reply and the user turn answering it.
+        # The latest assistant reply stays, the latest turn (e.g. a repair request) refers to it.
+        while len(messages) > 3 and estimate_tokens(messages) > self.token_budget:
+            del messages[1:3]
+
+        return messages
@@ -0,0 +1,64 @@
+from typing import Optional
+
+from PIL import Image
+
+from halligan.utils.encoding import ImageEncoder, default_encoder
+from halligan.agents.agent import AsyncGPTAgent, Metadata
+from halligan.agents.cache import ResponseCache
+from halligan.agents.retry import RetryPolicy
+
+
+class AgentPool:
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "gpt-4o-2024-11-20",
+        size: int = 8,
+        cache: Optional[ResponseCache] = None,
+        encoder: ImageEncoder = default_encoder,
+        base_url: Optional[str] = None,
+        retry: Optional[RetryPolicy] = None
+    ) -> None:
+        """
+        A pool of stateless, single-shot agents.
+        Every call is made by a fresh agent with an empty history, so calls from different
+        threads or episodes never see each other's conversation and can safely overlap.
+        At most `size` requests are in flight at a time, the rest wait for a free slot.
+        """
+        self.size = size
+        self._agent = AsyncGPTAgent(
+            api_key=api_key, model=model, max_concurrency=size,
+            cache=cache, encoder=encoder, base_url=base_url, retry=retry
+        )
+
+    @property
+    def cache(self) -> Optional[ResponseCache]:
+        return self._agent.cache
+
+    @cache.setter
+    def cache(self, cache: Optional[ResponseCache]) -> None:
+        self._agent.cache = cache
+
+    def __call__(
+        self,
+        prompt: str,
+        images: Optional[list[Image.Image]] = [],
+        image_captions: Optional[list[str]] = [],
+        stop_after: Optional[str] = None
+    ) -> tuple[str, Metadata]:
+        return self._agent.fork()(prompt, images, image_captions, stop_after=stop_after)
+
+    async def acall(
+        self,
+        prompt: str,
+        images: Optional[list[Image.Image]] = [],
+        image_captions: Optional[list[str]] = [],
+        stop_after: Optional[str] = None
+    ) -> tuple[str, Metadata]:
+        return await self._agent.fork().acall(prompt, images, image_captions, stop_after=stop_after)
+
+    def map(self, calls: list[tuple[str, list[Image.Image], list[str]]]) -> list[tuple[str, Metadata]]:
+        """
+        Send independent (prompt, images, image_captions) requests concurrently, results are returned in order.
+        """
+        return self._agent.map(calls)
@@ -0,0 +1,197 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from typing import Optional, Callable, Awaitable, TypeVar
+from timeit import default_timer as timer
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import openai
+
+from halligan.utils.metrics import Metrics, quantile
+
+
+T = TypeVar("T")
+
+# Errors worth retrying, the request itself was fine
+TRANSIENT_ERRORS = (
+    openai.APIConnectionError,  # Includes APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError
+)
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 100) -> None:
+        """
+        Keeps the latencies of the latest `window` successful requests.
+        """
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._latencies)
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def quantile(self, q: float) -> float:
+        with self._lock:
+            latencies = sorted(self._latencies)
+        return quantile(latencies, q)
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_retries: int = 3,
+        timeout: float = 30.0,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+        hedge_quantile: Optional[float] = None,
+        hedge_min_samples: int = 20
+    ) -> None:
+        """
+        Retry transient errors (timeouts, connection errors, 429 and 5xx) with jittered exponential backoff.
+        `timeout`: per attempt timeout (seconds).
+        `backoff`: the n-th retry waits a random delay up to `backoff * 2^n`, capped at `max_backoff`.
+            A Retry-After header, if sent, is waited at least.
+        `hedge_quantile`: if set (e.g. 0.95), a duplicate request is sent once an attempt is slower
+            than this quantile of recent latencies, and whichever returns first is used.
+            Hedging starts once `hedge_min_samples` latencies have been observed.
+            A losing async attempt is cancelled. A blocking (sync) attempt cannot be stopped once sent,
+            it runs to completion in the background and is discarded. Only winning attempts are tracked.
+        """
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = LatencyTracker()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        """
+        Read the policy from VLM_MAX_RETRIES, VLM_TIMEOUT and VLM_HEDGE_QUANTILE.
+        """
+        hedge_quantile = os.getenv("VLM_HEDGE_QUANTILE")
+        return cls(
+            max_retries=int(os.getenv("VLM_MAX_RETRIES", 3)),
+            timeout=float(os.getenv("VLM_TIMEOUT", 30.0)),
+            hedge_quantile=float(hedge_quantile) if hedge_quantile else None
+        )
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            return max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            return delay
+
+    def hedge_after(self) -> Optional[float]:
+        """
+        Seconds to wait for an attempt before sending a duplicate, None if hedging is off.
+        """
+        if self.hedge_quantile is None or len(self.latencies) < self.hedge_min_samples:
+            return None
+        return self.latencies.quantile(self.hedge_quantile)
+
+    def call(self, request: Callable[[], T]) -> T:
+        """
+        Make a (blocking) request, retrying and hedging as configured.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._hedged(request)
+            except TRANSIENT_ERRORS as error:
+                if attempt == self.max_retries: raise
+                Metrics.increment("halligan_vlm_retries_total", error=type(error).__name__)
+                time.sleep(self.delay(attempt, error))
+
+    async def acall(self, request: Callable[[], Awaitable[T]]) -> T:
+        """
+        Make an async request, retrying and hedging as configured.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._ahedged(request)
+            except TRANSIENT_ERRORS as error:
+                if attempt == self.max_retries: raise
+                Metrics.increment("halligan_vlm_retries_total", error=type(error).__name__)
+                await asyncio.sleep(self.delay(attempt, error))
+
+    def _timed(self, request: Callable[[], T]) -> T:
+        start_time = timer()
+        result = request()
+        self.latencies.add(timer() - start_time)
+        return result
+
+    async def _atimed(self, request: Callable[[], Awaitable[T]]) -> T:
+        start_time = timer()
+        result = await request()
+        self.latencies.add(timer() - start_time)
+        return result
+
+    @staticmethod
+    def _measure(request: Callable[[], T]) -> tuple[T, float]:
+        start_time = timer()
+        result = request()
+        return result, timer() - start_time
+
+    def _record(self, future: Future) -> T:
+        # Track the latency of the attempt that is used, raises if it failed
+        result, seconds = future.result()
+        self.latencies.add(seconds)
+        return result
+
+    def _hedged(self, request: Callable[[], T]) -> T:
+        hedge_after = self.hedge_after()
+        if hedge_after is None:
+            return self._timed(request)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(thread_name_prefix="hedge")
+
+        primary = self._executor.submit(self._measure, request)
+        done, _ = wait([primary], timeout=hedge_after)
+        if done: return self._record(primary)
+
+        Metrics.increment("halligan_vlm_hedges_total")
+        pending = {primary, self._executor.submit(self._measure, request)}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # Use the first success, fail only if both attempts fail.
+            # The other attempt is already running and cannot be cancelled, its result is ignored.
+            for future in sorted(done, key=lambda future: future.exception() is not None):
+                if future.exception() is None or not pending:
+                    return self._record(future)
+
+    async def _ahedged(self, request: Callable[[], Awaitable[T]]) -> T:
+        hedge_after = self.hedge_after()
+        if hedge_after is None:
+            return await self._atimed(request)
+
+        primary = asyncio.ensure_future(self._atimed(request))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_after)
+            if done: return primary.result()
+
+            Metrics.increment("halligan_vlm_hedges_total")
+            pending.add(asyncio.ensure_future(self._atimed(request)))
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Use the first success, fail only if both attempts fail
+                for task in sorted(done, key=lambda task: task.exception() is not None):
+                    if task.exception() is None or not pending:
+                        return task.result()
+        finally:
+            # The slower attempt is cancelled, its response is never used
+            for task in pending: task.cancel()
@@ -6,12 +6,14 @@ from halligan.agents import Agent
 from halligan.utils.layout import Frame
 from halligan.utils.constants import Stage
 from halligan.utils.logger import Trace
+from halligan.utils.metrics import Metrics
 
 
 stage = Stage.OBJECTIVE_IDENTIFICATION
 
 
 @Trace.section("Objective Identification")
+@Metrics.timed("halligan_stage_seconds", stage="objective_identification")
 def objective_identification(agent: Agent, frames: list[Frame]) -> str:
     """
     Ask the agent to give a detailed visual description of each frame.
@@ -35,7 +37,7 @@ def objective_identification(agent: Agent, frames: list[Frame]) -> str:
         frames[frame_id].description = description
 
     def relate(frame_id1: int, frame_id2: int = None, relationship: str = ""):
-        frames[frame_id1].relations[frame_id2] = relationship
+        frames[frame_id1].relate(frame_id2, relationship)
 
     def objective(description: str):
         nonlocal task_objective
@@ -9,6 +9,7 @@ from halligan.utils.toolkit import Toolkit
 from halligan.utils.constants import Stage
 from halligan.utils.layout import Frame, Element, get_observation
 from halligan.utils.logger import Trace
+from halligan.utils.metrics import Metrics
 
 
 stage = Stage.STRUCTURE_ABSTRACTION
@@ -17,6 +18,7 @@ stage = Stage.STRUCTURE_ABSTRACTION
 toolkit = Toolkit(
     tools=[
         Frame.get_element,
+        Frame.get_elements,
         Frame.split,
         Frame.grid,
         Frame.set_frame_as,
@@ -31,6 +33,7 @@ toolkit = Toolkit(
 
 
 @Trace.section("Structure Abstraction")
+@Metrics.timed("halligan_stage_seconds", stage="structure_abstraction")
 def structure_abstraction(agent: Agent, frames: list[Frame], objective: str) -> None: 
     """
     Instruct the agent to annotate interactable Frames and Elements. 
@@ -67,7 +70,7 @@ def structure_abstraction(agent: Agent, frames: list[Frame], objective: str) ->
     print(prompt)
 
     # Request script from agent
-    response, _ = agent(prompt, images, image_captions)
+    response, _ = agent(prompt, images, image_captions, stop_after="structure_abstraction")
     script = get_script(response)
     print(script)
 
@@ -4,8 +4,9 @@ from textwrap import indent
 
 import halligan.prompts as Prompts
 import halligan.utils.examples as Examples
-from halligan.agents import Agent
+from halligan.agents import Agent, HistoryPolicy
 from halligan.utils.logger import Trace
+from halligan.utils.metrics import Metrics
 from halligan.utils.constants import Stage
 from halligan.utils.constants import InteractableElement
 from halligan.utils.action_tools import action_toolkits
@@ -17,6 +18,7 @@ stage = Stage.SOLUTION_COMPOSITION
 
 
 @Trace.section("Solution Composition")
+@Metrics.timed("halligan_stage_seconds", stage="solution_composition")
 def solution_composition(agent: Agent, frames: list[Frame], objective: str) -> None: 
     """
     Agent composes a Python executable solution using vision and action tools.
@@ -80,7 +82,7 @@ def solution_composition(agent: Agent, frames: list[Frame], objective: str) -> N
 
     # Request script from agent 
     try:
-        response, _ = agent(prompt, images, image_captions)
+        response, _ = agent(prompt, images, image_captions, stop_after="solve")
         script = get_script(response)
         print(script)
         execute_script(script, dependencies)
@@ -88,10 +90,14 @@ def solution_composition(agent: Agent, frames: list[Frame], objective: str) -> N
     except Exception as e:
         feedback = e
 
+        # Repair turns are text-only, stop resending the observation images
+        history_policy = agent.history_policy
+        agent.history_policy = HistoryPolicy(max_image_turns=1)
+
         for _ in range(3):
             try:
                 print(feedback)
-                response, _ = agent(f"Your code has errors, please fix it.\n{feedback}")
+                response, _ = agent(f"Your code has errors, please fix it.\n{feedback}", stop_after="solve")
                 script = get_script(response)
                 print(script)
                 execute_script(script, dependencies)
@@ -100,4 +106,6 @@ def solution_composition(agent: Agent, frames: list[Frame], objective: str) -> N
             except Exception as e:
                 feedback = e
 
+        agent.history_policy = history_policy
+
     agent.reset()
\ No newline at end of file
@@ -4,7 +4,7 @@ from __future__ import annotations
 import io
 import time
 import itertools
-from copy import deepcopy
+from copy import copy
 from typing import Union, Literal, List
 
 import PIL.Image
@@ -13,8 +13,9 @@ from dotenv import load_dotenv
 from playwright.sync_api import Page
 
 from halligan.utils.toolkit import Toolkit
+from halligan.utils.metrics import Metrics
 from halligan.utils.layout import Frame, Element, Point
-from halligan.utils.vision_tools import match
+from halligan.utils.vision_tools import match_matrix
 
 
 load_dotenv()
@@ -27,6 +28,7 @@ def set_page(p: Page):
     page = p
 
 
+@Metrics.timed("halligan_tool_seconds", tool="screenshot")
 def screenshot(region: list[float] = None) -> PIL.Image.Image:
     if region:
         region = {
@@ -234,6 +236,7 @@ def click_and_hold(target: Union[Frame, Element], observe: Frame):
         yield Choice(image)
 
 
+@Metrics.timed("halligan_tool_seconds", tool="get_all_choices")
 def get_all_choices(prev_arrow: Element, next_arrow: Element, observe: Frame) -> list[SelectChoice]:
     """
     Cycle through all choices by clicking arrow buttons.
@@ -283,8 +286,7 @@ def drag(start: Element, end: Point) -> list[DragChoice]:
     """
     import cv2
     import numpy as np
-    def get_mask(image: PIL.Image.Image) -> np.ndarray:
-        image = np.array(image)
+    def get_mask(image: np.ndarray) -> np.ndarray:
         gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
         _, mask = cv2.threshold(gray, 240, 255, cv2.THRESH_BINARY_INV)
         #mask = cv2.bitwise_not(mask) 
@@ -292,6 +294,7 @@ def drag(start: Element, end: Point) -> list[DragChoice]:
         return mask
 
     x2, y2 = end.center
+    mask = get_mask(start.array)
     choices = []
     step = 10
     # Create 3 x 3 choices centered at (x, y) with step size 10px
@@ -306,7 +309,6 @@ def drag(start: Element, end: Point) -> list[DragChoice]:
                 start.w + margin * 2,
                 start.h + margin * 2
             ]
-            mask = get_mask(start.image)
             image = screenshot(region)
             image.paste(start.image, box=(margin, margin), mask=mask)
             choices.append(DragChoice(image, start.center, end=(cx, cy)))
@@ -357,6 +359,7 @@ def select(choice: Union[Frame, Element]) -> None:
     page.mouse.click(x, y)
 
 
+@Metrics.timed("halligan_tool_seconds", tool="slide_x")
 def slide_x(handle: Element, direction: Literal['left', 'right'], observe_frame: Frame) -> list[SlideChoice]:
     """
     Drag and move slider handle left/right while observing changes in a frame.
@@ -412,6 +415,7 @@ def slide_y(handle: Element, direction: Literal['up', 'down'], observe_frame: Fr
     return choices
 
 
+@Metrics.timed("halligan_tool_seconds", tool="explore")
 def explore(grid: Frame) -> list[SwapChoice]:
     """
     Get all possible ways to swap elements in the grid.
@@ -437,20 +441,22 @@ def explore(grid: Frame) -> list[SwapChoice]:
     rows, cols = len(rows), len(rows[-1])
     choices_by_distance = {d: [] for d in range(1, rows + cols)}
     all_cells = list(itertools.product(range(rows), range(cols)))
+    matches = match_matrix([element_grid[r][c] for r, c in all_cells])
 
-    for (r1, c1), (r2, c2) in itertools.combinations(all_cells, 2):
-        if match(element_grid[r1][c1], element_grid[r2][c2]): continue
+    for (i, (r1, c1)), (j, (r2, c2)) in itertools.combinations(enumerate(all_cells), 2):
+        if matches[i][j]: continue
 
         manhattan_distance = abs(r1 - r2) + abs(c1 - c2)
-        swapped_grid = deepcopy(element_grid)
+        # Elements share their frame and pixels, only the swapped images differ
+        swapped_grid = [[copy(element) for element in row] for row in element_grid]
+        swapped_grid[r1][c1] = element_grid[r1][c1]._with_image(element_grid[r2][c2].image)
+        swapped_grid[r2][c2] = element_grid[r2][c2]._with_image(element_grid[r1][c1].image)
 
         # Update grid image
         image = grid.image.copy()
-        image.paste(swapped_grid[r1][c1].image, (swapped_grid[r2][c2].x - grid.x, swapped_grid[r2][c2].y - grid.y))
-        image.paste(swapped_grid[r2][c2].image, (swapped_grid[r1][c1].x - grid.x, swapped_grid[r1][c1].y - grid.y))
+        image.paste(swapped_grid[r1][c1].image, (swapped_grid[r1][c1].x - grid.x, swapped_grid[r1][c1].y - grid.y))
+        image.paste(swapped_grid[r2][c2].image, (swapped_grid[r2][c2].x - grid.x, swapped_grid[r2][c2].y - grid.y))
 
-        # Swap elements
-        swapped_grid[r1][c1].image, swapped_grid[r2][c2].image = swapped_grid[r2][c2].image, swapped_grid[r1][c1].image
         swap_from = (swapped_grid[r1][c1].x + swapped_grid[r1][c1].w // 2, swapped_grid[r1][c1].y + swapped_grid[r1][c1].h // 2)
         swap_to = (swapped_grid[r2][c2].x + swapped_grid[r2][c2].w // 2, swapped_grid[r2][c2].y + swapped_grid[r2][c2].h // 2)
 
@@ -0,0 +1,120 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Hashable, Any
+
+import PIL.Image
+
+
+CACHE_DIR = os.getenv("HALLIGAN_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "halligan"))
+
+
+class DiskCache:
+    def __init__(self, path: str, max_bytes: int = 1 << 30) -> None:
+        """
+        A content-addressed store of byte values on disk.
+        Entries are evicted least-recently-used first once the store exceeds `max_bytes`.
+        Recency is tracked with file modification times, so it survives restarts.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self) -> list[os.DirEntry]:
+        entries = []
+        for shard in os.scandir(self.path):
+            if shard.is_dir():
+                entries.extend(entry for entry in os.scandir(shard.path) if entry.is_file())
+        return entries
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        file = self._file(key)
+        try:
+            with open(file, "rb") as f:
+                value = f.read()
+            os.utime(file)
+        except FileNotFoundError:
+            with self._lock: self.misses += 1
+            return None
+
+        with self._lock: self.hits += 1
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        file = self._file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+
+        # Write to a temporary file first so readers never see partial entries
+        temp = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, "wb") as f:
+            f.write(value)
+
+        with self._lock:
+            if os.path.exists(file): self._size -= os.path.getsize(file)
+            os.replace(temp, file)
+            self._size += len(value)
+            if self._size > self.max_bytes: self._evict()
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self._size <= self.max_bytes: break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._size -= size
+            except FileNotFoundError:
+                continue
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "bytes": self._size}
+
+
+class LRUCache:
+    def __init__(self, capacity: int = 1024) -> None:
+        """
+        A thread-safe in-memory mapping that keeps the `capacity` most recently used entries.
+        """
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+def image_hash(image: PIL.Image.Image) -> str:
+    """
+    Hash the pixel content of an image, two images with equal pixels have equal hashes.
+    """
+    digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+    digest.update(f"{image.mode}{image.size}".encode())
+    return digest.hexdigest()
@@ -0,0 +1,64 @@
+import io
+import base64
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+
+import PIL.Image
+
+from halligan.utils.cache import LRUCache, image_hash
+
+
+class ImageEncoder:
+    def __init__(
+        self,
+        max_edge: Optional[int] = None,
+        quality: int = 75,
+        workers: int = 4,
+        capacity: int = 1024
+    ) -> None:
+        """
+        Encodes images into JPEG data URLs for VLM payloads.
+        Images larger than `max_edge` are downscaled first (aspect ratio is kept).
+        Encoded images are memoized by pixel content, so the same image is only encoded once.
+        Batches are encoded on a thread pool, Pillow releases the GIL while encoding.
+        """
+        self.max_edge = max_edge
+        self.quality = quality
+        self.cache = LRUCache(capacity)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encoder")
+
+    def _encode(self, image: PIL.Image.Image) -> str:
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        if self.max_edge and max(image.size) > self.max_edge:
+            scale = self.max_edge / max(image.size)
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, PIL.Image.Resampling.LANCZOS)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=self.quality)
+        image_b64 = base64.b64encode(buffer.getvalue()).decode("ascii")
+        return f"data:image/jpeg;base64,{image_b64}"
+
+    def encode(self, image: PIL.Image.Image) -> str:
+        """
+        Get the JPEG data URL of an image.
+        """
+        key = image_hash(image)
+        url = self.cache.get(key)
+        if url is None:
+            url = self._encode(image)
+            self.cache.put(key, url)
+        return url
+
+    def encode_all(self, images: list[PIL.Image.Image]) -> list[str]:
+        """
+        Get the JPEG data URLs of a batch of images, encoded concurrently.
+        """
+        if len(images) <= 1:
+            return [self.encode(image) for image in images]
+        return list(self.executor.map(self.encode, images))
+
+
+default_encoder = ImageEncoder()
@@ -1,36 +1,185 @@
 from __future__ import annotations
+import io
+import os
 import math
+import itertools
 from abc import ABC
-from typing import TypeAlias, Literal
-from collections import Counter, deque, defaultdict
+from copy import copy
+from typing import TypeAlias, Literal, Optional
+from collections import Counter, deque
 
 import cv2
-import faiss
 import numpy as np
 import PIL.Image
 from PIL import ImageDraw, ImageChops
 from skimage.segmentation import slic
-from skimage.measure import regionprops
-from scipy.ndimage import binary_fill_holes
 
 from halligan.utils.constants import InteractableElement, InteractableFrame
 from halligan.models import CLIP, Segmenter
+from halligan.utils.metrics import Metrics
+from halligan.utils.cache import CACHE_DIR, DiskCache, LRUCache, image_hash
+from halligan.utils.spatial import GridIndex
 
 
 Position: TypeAlias = Literal["up", "down", "left", "right"]
+Region: TypeAlias = tuple[int, int, int, int]
+
+# Segmentation results (bboxes, crops, CLIP features) persist across runs, keyed by frame content.
+# Bump the version when the segmenter or CLIP model changes.
+SEGMENTS_VERSION = "v1"
+segment_cache = DiskCache(
+    os.path.join(CACHE_DIR, "segments"),
+    max_bytes=int(os.getenv("SEGMENT_CACHE_BYTES", 2 << 30))
+)
+
+# Superpixels shown around a point by `Point.show_neighbours`
+NEIGHBOURS = 20
+
+# SLIC returns about 3/4 of the superpixels asked for, the fine level asks for more to make up for it
+SLIC_OVERSAMPLE = 4 / 3
+
+# Frames take a new revision whenever a change alters the observation, see `get_observation`
+_revisions = itertools.count(1)
+
+# Normalized CLIP text features of element details, which recur across frames and episodes
+text_feature_cache = LRUCache(capacity=4096)
+
+
+def _text_features(details: list[str]) -> np.ndarray:
+    features = {detail: text_feature_cache.get(detail) for detail in dict.fromkeys(details)}
+
+    # Encode all unseen details in one batch
+    misses = [detail for detail, feature in features.items() if feature is None]
+    if misses:
+        encoded = np.asarray(CLIP.get_text_features(misses), dtype=np.float32)
+        encoded = encoded / np.linalg.norm(encoded, ord=2, axis=-1, keepdims=True)
+        for detail, feature in zip(misses, encoded):
+            features[detail] = feature
+            text_feature_cache.put(detail, feature)
+
+    return np.stack([features[detail] for detail in details])
+
+
+def _superpixel_stats(
+    segments: np.ndarray, 
+    values: Optional[np.ndarray] = None
+) -> tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Integer centroids (x, y) of each superpixel, and the mean of `values` within each superpixel.
+    Superpixels are in label order as in `regionprops`, computed in one pass over the labels.
+    """
+    labels = segments.ravel()
+    counts = np.bincount(labels)
+    present = np.flatnonzero(counts)
+    present = present[present > 0]
+    counts = counts[present]
+
+    rows, cols = np.divmod(np.arange(labels.size), segments.shape[1])
+    cy = np.bincount(labels, weights=rows)[present] / counts
+    cx = np.bincount(labels, weights=cols)[present] / counts
+    centroids = np.stack([cx, cy], axis=1).astype(int)
+
+    if values is None: return centroids, None
+    return centroids, np.bincount(labels, weights=values.ravel())[present] / counts
+
+
+def _fill_holes(mask: np.ndarray) -> np.ndarray:
+    """
+    Fill holes in a binary (0, 255) image, same as `scipy.ndimage.binary_fill_holes`.
+    Flood fills the background from the border, pixels it does not reach are holes.
+    """
+    background = cv2.copyMakeBorder(mask, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    flood_mask = np.zeros((background.shape[0] + 2, background.shape[1] + 2), np.uint8)
+    cv2.floodFill(background, flood_mask, (0, 0), 255)
+    holes = cv2.bitwise_not(background)[1:-1, 1:-1]
+    return cv2.bitwise_or(np.where(mask > 0, 255, 0).astype(np.uint8), holes)
+
+
+def _to_rgb(pixels: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Convert L, RGB or RGBA pixels to RGB, written into `out` if given.
+    """
+    if pixels.ndim == 2:
+        return cv2.cvtColor(pixels, cv2.COLOR_GRAY2RGB, dst=out)
+    if pixels.shape[2] == 4:
+        return cv2.cvtColor(pixels, cv2.COLOR_RGBA2RGB, dst=out)
+    if out is None: return pixels
+    np.copyto(out, pixels)
+    return out
+
+
+def _annotate(canvas: np.ndarray, points: list[tuple[int, int]]) -> None:
+    # Number each point with black text on a white outline
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = 0.5
+    for i, (x, y) in enumerate(points):
+        cv2.putText(canvas, str(i), (x, y), font, font_scale, (255,255,255), 3, cv2.LINE_AA)
+        cv2.putText(canvas, str(i), (x, y), font, font_scale, (0,0,0), 1, cv2.LINE_AA)
+
+
+def _load_segments(image: PIL.Image.Image) -> Optional[tuple[np.ndarray, list[PIL.Image.Image], np.ndarray]]:
+    value = segment_cache.get(f"{image_hash(image)}-{SEGMENTS_VERSION}")
+    if value is None: return None
+
+    with np.load(io.BytesIO(value), allow_pickle=False) as data:
+        segments = [PIL.Image.fromarray(data[f"segment_{i}"]) for i in range(len(data["bboxes"]))]
+        return data["bboxes"], segments, data["features"]
+
+
+def _store_segments(
+    image: PIL.Image.Image, 
+    bboxes: list, 
+    segments: list[PIL.Image.Image], 
+    features: Optional[np.ndarray]
+) -> None:
+    arrays = {f"segment_{i}": np.asarray(segment) for i, segment in enumerate(segments)}
+    arrays["bboxes"] = np.asarray(bboxes, dtype=np.int64).reshape(-1, 4)
+    arrays["features"] = np.asarray(features, dtype=np.float32) if segments else np.empty((0, 0), np.float32)
+
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    segment_cache.put(f"{image_hash(image)}-{SEGMENTS_VERSION}", buffer.getvalue())
 
 
 class Component(ABC):
-    def __init__(self, x: int, y: int, image: PIL.Image.Image) -> None:
+    __slots__ = ("_image", "_array", "x", "y", "w", "h", "interactable")
+
+    def __init__(self, x: int, y: int, image: PIL.Image.Image | np.ndarray) -> None:
         """Manages a region that is part of the screen.
+        The image is a PIL image or an array (e.g. a view into the parent's pixels),
+        the other representation is only built when it is needed.
         """
-        self._image = image
+        self._image = image if isinstance(image, PIL.Image.Image) else None
+        self._array = image if isinstance(image, np.ndarray) else None
         self.x = int(x)
         self.y = int(y)
-        self.w = image.size[0]
-        self.h = image.size[1]
+        self.w, self.h = image.size if self._image is not None else (image.shape[1], image.shape[0])
         self.interactable: str = None # Stage 2: Interactable type
 
+    @property
+    def array(self) -> np.ndarray:
+        """
+        Read-only pixels of the component image.
+        """
+        if self._array is None:
+            self._array = np.asarray(self._image)
+        return self._array
+
+    def _get_image(self) -> PIL.Image.Image:
+        if self._image is None:
+            self._image = PIL.Image.fromarray(np.ascontiguousarray(self._array))
+        return self._image
+
+    def _crop(self, box: tuple[int, int, int, int]) -> PIL.Image.Image | np.ndarray:
+        """
+        Crop (left, upper, right, lower) from the component image without copying pixels.
+        Palette and other exotic modes do not round-trip through arrays, those are cropped with PIL.
+        """
+        if self._image is not None and self._image.mode not in ("RGB", "RGBA", "L"):
+            return self._image.crop(box)
+        left, upper, right, lower = box
+        return self.array[upper:lower, left:right]
+
     @property
     def bbox(self) -> list[int, int, int, int]:
         return [self.x, self.y, self.x + self.w, self.y + self.h]
@@ -59,10 +208,15 @@ class Frame(Component):
         """An image can be decomposed into frames.
         """
         super().__init__(x, y, image)
+        # Observation of this frame (as a leaf), and of the frame set it heads (as the first root frame)
+        self._revision = next(_revisions)
+        self._leaf_observation: tuple = None
+        self._observation: tuple = None
+
         # Visual description of the frame
-        self.description: str = ""
+        self._description: str = ""
 
-        # Tracks relations with other frames
+        # Tracks relations with other frames, use `relate` so the observation is updated
         self.relations: dict[int, str] = {}
 
         # Tracks subframes
@@ -72,49 +226,114 @@ class Frame(Component):
         self.interactables: list[Element] = []
 
         # Tracks detected keypoints
-        self.keypoints: list[tuple] = []
-
-        # Tracks all segmented elements
-        self._elements: dict[Position, list[Element]] = None
-        self._indexes: dict[Position, faiss.Index] = None
+        self.keypoints: list[Point] = []
+
+        # Superpixel pyramid, computed once per frame:
+        # coarse superpixels and saliency map of each keypoint region, and fine superpixel centroids
+        # (relative to screen) over the whole frame for neighbour lookups with their density per pixel,
+        # and superpixels of neighbourhoods the fine level covers too sparsely
+        self._superpixels: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        self._fine_superpixels: tuple[np.ndarray, GridIndex, float] = None
+        self._neighbourhoods: dict[Region, np.ndarray] = {}
+
+        # RGB pixels of the frame, and buffers that annotations are drawn on (one per shape)
+        self._rgb: np.ndarray = None
+        self._canvases: dict[tuple[int, int], np.ndarray] = {}
+
+        # Tracks all segmented elements, their visual features, the elements in each position
+        # and a spatial index of their centers
+        self._elements: list[Element] = None
+        self._features: np.ndarray = None
+        self._masks: dict[Position, np.ndarray] = None
+        self._index: GridIndex = None
     
     @property
     def image(self) -> PIL.Image.Image:
         """
         Each frame has a referenceable image for processing/analysis.
         """
-        return self._image
+        return self._get_image()
+
+    @property
+    def description(self) -> str:
+        return self._description
+
+    @description.setter
+    def description(self, value: str) -> None:
+        self._description = value
+        self._invalidate()
+
+    def relate(self, frame_id: int, relationship: str) -> None:
+        self.relations[frame_id] = relationship
+        self._invalidate()
+
+    def _invalidate(self) -> None:
+        self._revision = next(_revisions)
 
-    def get_element(self, position: Position, details: str) -> Element:
+    def get_element(self, position: Position | Region, details: str) -> Element:
         """
         Get one specific element by its relative position in the frame and its detailed visual description.
         Elements can be marked as interactables.
-        position: where is the element
+        position: where is the element, or a region (xmin, ymin, xmax, ymax) that contains its center
         details: color, shape, and visual features of the element
         """
-        if self._elements is None or self._indexes is None:
+        return self.get_elements([(position, details)])[0]
+
+    def get_elements(self, queries: list[tuple[Position | Region, str]]) -> list[Element]:
+        """
+        Get multiple elements at once, each query is a (position, details) pair as in `get_element`.
+        Returns the elements in the same order as the queries.
+        """
+        if self._features is None:
             self._segment()
-        
-        elements = self._elements.get(position, self._elements["all"])
 
-        if not elements: 
-            return Element(self.x, self.y, self._image, self)
+        if not self._elements: 
+            return [Element(self.x, self.y, self._image, self) for _ in queries]
         
-        index = self._indexes.get(position, self._indexes["all"])
-        text_feature = CLIP.get_text_features(details)
+        # Score every element against all queries at once
+        text_features = _text_features([details for _, details in queries])
+        scores = self._features @ text_features.T
+
+        elements = []
+        for (position, _), query_scores in zip(queries, scores.T):
+            # Search elements in the position or region, or the whole frame if there are none
+            candidates = self._candidates(position)
+            if not len(candidates): candidates = np.arange(len(self._elements))
+            matches = candidates[np.argsort(-query_scores[candidates], kind="stable")[:5]]
+            elements.append(self._retrieve(matches))
+
+        return elements
+
+    def _candidates(self, position: Position | Region) -> np.ndarray:
+        if isinstance(position, str):
+            mask = self._masks.get(position)
+            return np.flatnonzero(mask) if mask is not None else np.empty(0, int)
+        return self._index.within(position)
+
+    def get_nearest(self, target: Component | tuple[int, int], k: int = 1) -> list[Element]:
+        """
+        Get the k segmented elements whose centers are closest to a point (x, y) or to another component, nearest first.
+        """
+        if self._features is None:
+            self._segment()
 
-        text_feature = text_feature / np.linalg.norm(text_feature, ord=2, axis=-1, keepdims=True)
-        _, matches = index.search(text_feature, k=5)
+        if isinstance(target, Component):
+            # One more, the target itself may be among the elements
+            matches = self._index.nearest(*target.center, k=k + 1)
+            return [self._elements[i] for i in matches if self._elements[i] is not target][:k]
+        
+        return [self._elements[i] for i in self._index.nearest(*target, k=k)]
 
+    def _retrieve(self, matches: np.ndarray) -> Element:
         # Return the first element that was not annotated
-        for index in matches[0]:
-            element: Element = elements[index]
+        for index in matches:
+            element: Element = self._elements[index]
             if not element.retrieved:
                 element.retrieved = True
                 return element
         
         # If all elements were annotated, return the best match
-        return elements[matches[0][0]]
+        return self._elements[matches[0]]
     
     def get_interactable(self, id: int) -> Element:
         """
@@ -128,6 +347,57 @@ class Frame(Component):
         """
         return self.keypoints[id]
     
+    def _rgb_pixels(self) -> np.ndarray:
+        if self._rgb is None:
+            image = self._image
+            if image is not None and image.mode not in ("RGB", "RGBA", "L"):
+                self._rgb = np.asarray(image.convert("RGB"))
+            else:
+                self._rgb = _to_rgb(self.array)
+        return self._rgb
+
+    def _fine_level(self) -> tuple[np.ndarray, GridIndex, float]:
+        """
+        Fine superpixels over the whole frame, about `NEIGHBOURS` in each 200 x 200 neighbourhood
+        (clipped to the frame), and the number of superpixels per pixel SLIC actually returned.
+        """
+        if self._fine_superpixels is None:
+            window = min(self.w, 200) * min(self.h, 200)
+            n_segments = math.ceil(self.w * self.h / window * NEIGHBOURS * SLIC_OVERSAMPLE)
+            segments = slic(self._rgb_pixels(), n_segments=n_segments, compactness=10)
+            centroids, _ = _superpixel_stats(segments)
+            centroids = centroids + (self.x, self.y)
+            density = len(centroids) / (self.w * self.h)
+            self._fine_superpixels = centroids, GridIndex(centroids, cell_size=50), density
+        return self._fine_superpixels
+
+    def _neighbourhood(self, window: Region) -> np.ndarray:
+        """
+        Centroids (relative to screen) of about `NEIGHBOURS` superpixels in a window (xmin, ymin, xmax, ymax) of the frame.
+        Taken from the fine level, unless it has well under the count expected for the window's area there,
+        then the window is segmented on its own.
+        """
+        xmin, ymin, xmax, ymax = window
+        centroids, index, density = self._fine_level()
+        nearby = centroids[index.within(window)]
+        expected = min(NEIGHBOURS, density * (xmax - xmin) * (ymax - ymin))
+        if len(nearby) >= expected * 3 / 4: return nearby
+
+        if window not in self._neighbourhoods:
+            pixels = self._rgb_pixels()[ymin - self.y:ymax - self.y, xmin - self.x:xmax - self.x]
+            segments = slic(pixels, n_segments=NEIGHBOURS, compactness=10)
+            self._neighbourhoods[window] = _superpixel_stats(segments)[0] + (xmin, ymin)
+        return self._neighbourhoods[window]
+
+    def _canvas(self, pixels: np.ndarray) -> np.ndarray:
+        """
+        Copy `pixels` as RGB into this frame's reusable annotation buffer of the same size.
+        """
+        shape = pixels.shape[:2]
+        if shape not in self._canvases:
+            self._canvases[shape] = np.empty((*shape, 3), np.uint8)
+        return _to_rgb(pixels, self._canvases[shape])
+
     def show_keypoints(self, region: Literal['all', 'top', 'bottom', 'left', 'right']) -> PIL.Image.Image:
         """
         Annotate keypoints on the Frame. Each keypoint has a number ID.
@@ -135,64 +405,56 @@ class Frame(Component):
         Returns
             image (PIL.Image.Image): The frame image with all keypoints annotated on it.
         """
+        rgb = self._rgb_pixels()
         if region == "top":
-            img = self.image.crop((0, 0, self.w, self.h // 2))
+            img = rgb[:self.h // 2, :]
             x_offset, y_offset = 0, 0
         elif region == "bottom":
-            img = self.image.crop((0, self.h // 2, self.w, self.h))
+            img = rgb[self.h // 2:, :]
             x_offset, y_offset = 0, self.h // 2
         elif region == "left":
-            img = self.image.crop((0, 0, self.w // 2, self.h))
+            img = rgb[:, :self.w // 2]
             x_offset, y_offset = 0, 0
         elif region == "right":
-            img = self.image.crop((self.w // 2, 0, self.w, self.h))
+            img = rgb[:, self.w // 2:]
             x_offset, y_offset = self.w // 2, 0
         else:
-            img = self.image
+            img = rgb
             x_offset, y_offset = 0, 0
 
-        img = np.array(img)
-        img = cv2.cvtColor(img, cv2.COLOR_RGBA2RGB)
-        h, w, _ = img.shape
+        h, w = img.shape[:2]
 
-        # Compute the number of SLIC segments based on image size
-        size = max(1, round(h / 100)) * max(1, round(w / 100))
-        n_segments = 25 if size <= 4 else 100
+        region = region if region in ("top", "bottom", "left", "right") else "all"
+        if region not in self._superpixels:
+            # Compute the number of SLIC segments based on image size
+            size = max(1, round(h / 100)) * max(1, round(w / 100))
+            n_segments = 25 if size <= 4 else 100
 
-        # Step 1: Generate superpixels using SLIC
-        segments = slic(img, n_segments=n_segments, compactness=10)
-        
-        # Step 2: Compute the saliency map using OpenCV's saliency detection
-        saliency = cv2.saliency.StaticSaliencySpectralResidual_create()
-        (_, saliency_map) = saliency.computeSaliency(img)
-        saliency_map = (saliency_map * 255).astype("uint8")
-        regions = regionprops(segments)
+            # Step 1: Generate superpixels using SLIC
+            segments = slic(img, n_segments=n_segments, compactness=10)
+            
+            # Step 2: Compute the saliency map using OpenCV's saliency detection
+            saliency = cv2.saliency.StaticSaliencySpectralResidual_create()
+            (_, saliency_map) = saliency.computeSaliency(img)
+            saliency_map = (saliency_map * 255).astype("uint8")
+            self._superpixels[region] = segments, saliency_map
+
+        segments, saliency_map = self._superpixels[region]
 
         # Step 3: Filter centroids based on saliency
-        saliency_scores = []
-        for props in regions:
-            cy, cx = map(int, props.centroid) 
-            superpixel_mask = segments == props.label
-            avg_saliency = np.mean(saliency_map[superpixel_mask])
-            saliency_scores.append((avg_saliency, cx, cy))
-
-        saliency_values = [score[0] for score in saliency_scores]
+        centroids, saliency_values = _superpixel_stats(segments, saliency_map)
         threshold = np.percentile(saliency_values, 50)
-        keypoints = [(cx, cy) for avg_saliency, cx, cy in saliency_scores if avg_saliency > threshold]
+        keypoints = centroids[saliency_values > threshold]
 
-        for (cx, cy) in keypoints:
-            image = self.image.crop(box=(cx, cy, cx + 1, cy + 1))
-            self.keypoints.append(Point(self.x + x_offset + cx, self.y + y_offset + cy, image, self))
+        # Points only hold coordinates, their pixels are read from the frame when needed
+        for cx, cy in (keypoints + (self.x + x_offset, self.y + y_offset)).tolist():
+            self.keypoints.append(Point(cx, cy, self))
 
-        annotated_img = img.copy()
-        for j, keypoint in enumerate(keypoints):
-            cx, cy = keypoint
-            font = cv2.FONT_HERSHEY_SIMPLEX
-            font_scale = 0.5
-            cv2.putText(annotated_img, str(j), (cx, cy), font, font_scale, (255,255,255), 3, cv2.LINE_AA)
-            cv2.putText(annotated_img, str(j), (cx, cy), font, font_scale, (0,0,0), 1, cv2.LINE_AA)
+        canvas = self._canvas(img)
+        _annotate(canvas, keypoints.tolist())
 
-        return PIL.Image.fromarray(annotated_img)
+        # The image gets its own copy of the pixels, the canvas is reused
+        return PIL.Image.fromarray(canvas)
 
     def split(self, rows: int, columns: int) -> list[Frame]:
         """
@@ -210,11 +472,12 @@ class Frame(Component):
             for j in range(columns):
                 x = j * choice_width
                 y = i * choice_height
-                image = self.image.crop(box=(x, y, x + choice_width, y + choice_height))
+                image = self._crop((x, y, x + choice_width, y + choice_height))
                 choice = Frame(self.x + x, self.y + y, image)
                 choices.append(choice)
 
         self.subframes = choices
+        self._invalidate()
         return choices
 
     def grid(self, tiles: int) -> list[list[Element]]:
@@ -238,13 +501,16 @@ class Frame(Component):
             for j in range(cols):
                 x = j * tile_w
                 y = i * tile_h
-                image = self.image.crop(box=(x, y, x + tile_w, y + tile_h))
+                image = self._crop((x, y, x + tile_w, y + tile_h))
                 tile = Element(self.x + x, self.y + y, image, self)
                 _tiles.append(tile)
 
             _grid.append(_tiles)
 
+        # Tiles replace the segmented elements, segment again if elements are queried
         self._elements = _grid
+        self._features = None
+        self._invalidate()
         return _grid
 
     def set_frame_as(self, interactable: str) -> None:
@@ -252,13 +518,25 @@ class Frame(Component):
         ( Docstring will be dynamically replaced by items in InteractableFrame. )
         """
         self.interactable = interactable
+        self._invalidate()
 
+    @Metrics.timed("halligan_layout_seconds", op="segment")
     def _segment(self) -> None:
-        self._elements = defaultdict(list)
-        self._indexes = {}
+        self._elements = []
+        self._features = np.empty((0, 0), np.float32)
+        self._masks = {}
+        self._index = GridIndex(np.empty((0, 2)))
+
+        # Segment the frame into elements and encode the visual features of each element,
+        # or reuse the results of an earlier run on the same image
+        cached = _load_segments(self.image)
+        if cached:
+            bboxes, segments, element_features = cached
+        else:
+            bboxes, _, segments = Segmenter.segment(self.image)
+            element_features = CLIP.get_image_features(segments) if segments else None
+            _store_segments(self.image, bboxes, segments, element_features)
 
-        # Segment the frame into elements
-        bboxes, _, segments = Segmenter.segment(self.image)
         element_list = [
             Element(
                 self.x + bbox[0], 
@@ -269,48 +547,28 @@ class Frame(Component):
         ]
 
         if not segments: return
-        
-        # Encode the visual features of each element
-        element_features = CLIP.get_image_features(segments)
 
-        # Group all elements by their position in frame region
-        frame_center_x, frame_center_y = self.x + self.w / 2, self.y + self.h / 2
-
-        positions = {
-            "all": lambda x, y: True,
-            "up": lambda x, y: y <= frame_center_y,
-            "down": lambda x, y: y > frame_center_y,
-            "left": lambda x, y: x <= frame_center_x, #and y > frame_center_y,
-            "right": lambda x, y: x > frame_center_x #and y > frame_center_y
-        }
+        # Only elements up to 300 x 300 pixels can be retrieved
+        keep = [i for i, element in enumerate(element_list) if element.w <= 300 and element.h <= 300]
+        if not keep: return
 
+        self._elements = [element_list[i] for i in keep]
+        self._features = np.asarray(element_features, dtype=np.float32)[keep]
 
-        self._elements = defaultdict(list)
-        self._indexes = {}
-        
-        
-        self._elements = defaultdict(list)
-        self._indexes = {}
-        
-        for position, check in positions.items():
-            group: list[Element] = []
-            features: list[np.ndarray] = []
-
-            for element, feature in zip(element_list, element_features):
-                if element.w > 300 or element.h > 300: continue
+        # Mark the elements in each position of the frame region
+        frame_center_x, frame_center_y = self.x + self.w / 2, self.y + self.h / 2
+        centers = np.array([(element.x + element.w / 2, element.y + element.h / 2) for element in self._elements])
 
-                element_center_x, element_center_y = element.x + element.w / 2, element.y + element.h / 2
-                
-                if check(element_center_x, element_center_y):
-                    group.append(element)
-                    features.append(feature)
+        self._masks = {
+            "up": centers[:, 1] <= frame_center_y,
+            "down": centers[:, 1] > frame_center_y,
+            "left": centers[:, 0] <= frame_center_x,
+            "right": centers[:, 0] > frame_center_x
+        }
 
-            if features:
-                index = faiss.IndexFlatIP(features[-1].shape[0])
-                index.add(np.array(features))
-                
-                self._elements[position] = group
-                self._indexes[position] = index
+        # Cells about the size of a typical element, so dense boards spread over many cells
+        sizes = [max(element.w, element.h) for element in self._elements]
+        self._index = GridIndex(centers, cell_size=max(8, float(np.median(sizes))))
 
 
 class Element(Component):
@@ -321,6 +579,9 @@ class Element(Component):
         self.parent = parent
         self.retrieved = False
 
+        # Shape and color descriptors, computed by `vision_tools.match` once per element image
+        self._descriptors = None
+
         if not self.is_within(parent): raise ValueError(f"{self} must be within {parent}")
 
     @property
@@ -328,11 +589,25 @@ class Element(Component):
         """
         Each element has a referenceable image for processing/analysis.
         """
-        return self._image
+        return self._get_image()
     
     @image.setter
     def image(self, value):
         self._image = value
+        self._array = None
+        self._descriptors = None
+        self.parent._invalidate()
+
+    def _with_image(self, image: PIL.Image.Image) -> Element:
+        """
+        Copy of this element showing another image, e.g. to try out a swap.
+        The parent frame is left as is, so its observation is not rebuilt.
+        """
+        element = copy(self)
+        element._image = image
+        element._array = None
+        element._descriptors = None
+        return element
 
     def set_element_as(self, interactable: str) -> None:
         """
@@ -340,55 +615,72 @@ class Element(Component):
         """
         self.interactable = interactable
         self.parent.interactables.append(self)
+        self.parent._invalidate()
 
 
 class Point(Component):
-    def __init__(self, x: int, y: int, image: PIL.Image.Image, parent: Frame) -> None:
+    __slots__ = ("parent", "neighbours")
+
+    def __init__(self, x: int, y: int, parent: Frame) -> None:
         """
-        A frame contains keypoints
+        A frame contains keypoints.
+        A point is a coordinate on its frame, its 1 x 1 image is read from the frame on demand.
         """
-        super().__init__(x, y, image)
+        self._image = None
+        self._array = None
+        self.x = int(x)
+        self.y = int(y)
+        self.w = self.h = 1
+        self.interactable = None
         self.parent = parent
-        self.neighbours = []
+        self.neighbours: list[Point] = []
+
+    def __iter__(self):
+        # Unpacks as (x, y)
+        yield self.x
+        yield self.y
+
+    def _load(self) -> None:
+        if self._image is None and self._array is None:
+            x, y = self.x - self.parent.x, self.y - self.parent.y
+            pixels = self.parent._crop((x, y, x + 1, y + 1))
+            if isinstance(pixels, PIL.Image.Image): self._image = pixels
+            else: self._array = pixels
+
+    @property
+    def array(self) -> np.ndarray:
+        self._load()
+        return Component.array.fget(self)
+
+    @property
+    def image(self) -> PIL.Image.Image:
+        self._load()
+        return self._get_image()
 
     def show_neighbours(self) -> PIL.Image.Image:
         """
         Reduce the search space for further analysis by narrowing down to keypoints surrounding this point.
         """
+        frame = self.parent
+
         # Relative to screen
-        xmin = max(self.parent.x, self.x - 100)
-        ymin = max(self.parent.y, self.y - 100)
-        xmax = min(self.parent.x + self.parent.w, self.x + 100)
-        ymax = min(self.parent.y + self.parent.h, self.y + 100)
-
-        # Relative to parent frame
-        region_img = self.parent.image.crop([
-            xmin - self.parent.x, ymin - self.parent.y, 
-            xmax - self.parent.x, ymax - self.parent.y
-        ])
-        region_img = np.array(region_img)
-        region_img = cv2.cvtColor(region_img, cv2.COLOR_RGBA2RGB)
-
-        annotated_img = self.parent.image.copy()
-        annotated_img = np.array(annotated_img)
-        segments = slic(region_img, n_segments=20, compactness=10)
-        regions = regionprops(segments)
-        for i, props in enumerate(regions):
-            cy, cx = map(int, props.centroid) 
-
-            # Relative to screen
-            image = PIL.Image.new("RGB", (1, 1))
-            self.neighbours.append(Point(xmin + cx, ymin + cy, image, self))
-
-            # Relative to parent frame
-            font = cv2.FONT_HERSHEY_SIMPLEX
-            font_scale = 0.5
-            px = xmin - self.parent.x + cx
-            py = ymin - self.parent.y + cy
-            cv2.putText(annotated_img, str(i), (px, py), font, font_scale, (255,255,255), 3, cv2.LINE_AA)
-            cv2.putText(annotated_img, str(i), (px, py), font, font_scale, (0,0,0), 1, cv2.LINE_AA)
-
-        return PIL.Image.fromarray(annotated_img)
+        xmin = max(frame.x, self.x - 100)
+        ymin = max(frame.y, self.y - 100)
+        xmax = min(frame.x + frame.w, self.x + 100)
+        ymax = min(frame.y + frame.h, self.y + 100)
+
+        # Superpixels of the frame around this point
+        nearby = frame._neighbourhood((xmin, ymin, xmax, ymax))
+
+        # Neighbours belong to the frame, so they can show their own neighbours
+        for cx, cy in nearby.tolist():
+            self.neighbours.append(Point(cx, cy, frame))
+
+        # Annotate relative to parent frame
+        canvas = frame._canvas(frame._rgb_pixels())
+        _annotate(canvas, (nearby - (frame.x, frame.y)).tolist())
+
+        return PIL.Image.fromarray(canvas)
     
     def get_neighbour(self, id: int) -> Point:
         """
@@ -397,6 +689,7 @@ class Point(Component):
         return self.neighbours[id]
 
 
+@Metrics.timed("halligan_layout_seconds", op="get_frames")
 def get_frames(x: int, y: int, image: PIL.Image.Image) -> list[Frame]:
     """
     Extract frames from the image
@@ -465,8 +758,8 @@ def get_frames(x: int, y: int, image: PIL.Image.Image) -> list[Frame]:
 
     # Pre-processing
     image = image.copy()
-    np_image = np.array(image)
-    np_image = cv2.cvtColor(np_image, cv2.COLOR_BGRA2GRAY)
+    pixels = np.asarray(image)
+    np_image = cv2.cvtColor(pixels, cv2.COLOR_BGRA2GRAY)
     np_image = cv2.medianBlur(np_image, 3)
     np_image = cv2.adaptiveThreshold(np_image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
     
@@ -476,11 +769,12 @@ def get_frames(x: int, y: int, image: PIL.Image.Image) -> list[Frame]:
     np_image = cv2.morphologyEx(np_image, cv2.MORPH_DILATE, kernel, iterations=3)
     np_image = fill_margins(np_image)
     np_image = cv2.bitwise_not(np_image)
-    np_image = binary_fill_holes(np_image).astype(np.uint8) * 255
+    np_image = _fill_holes(np_image)
     _, _, stats, _ = cv2.connectedComponentsWithStats(image=np_image, connectivity=8)
 
     # Filtering
     frames: list[Frame] = []
+    masks: list[tuple[int, int, int, int]] = []
     areas = stats[1:, cv2.CC_STAT_AREA]
     largest_indices = np.argsort(areas)[::-1]
     draw = ImageDraw.Draw(image)
@@ -492,14 +786,25 @@ def get_frames(x: int, y: int, image: PIL.Image.Image) -> list[Frame]:
         # Keep the frame based on its relative size when compared to previous Component
         if frames:
             area = fw * fh
-            prev_frame = frames[-1].image
-            prev_area = prev_frame.size[0] * prev_frame.size[1] 
+            prev_area = frames[-1].w * frames[-1].h
             if area < int(prev_area * 0.2): break
         
         # Create frame and mask its region from base image
-        frame_image = image.crop(box=(fx, fy, fx + fw, fy + fh))
-        frame = Frame(x + fx, y + fy, frame_image)
+        # Frames are views into the pixels, copied only if masked by a previous frame
+        frame_pixels = pixels[fy:fy + fh, fx:fx + fw]
+        overlaps = [
+            (max(px, fx), max(py, fy), min(px + pw + 1, fx + fw), min(py + ph + 1, fy + fh))
+            for px, py, pw, ph in masks
+        ]
+        overlaps = [(left, top, right, bottom) for left, top, right, bottom in overlaps if left < right and top < bottom]
+        if overlaps:
+            frame_pixels = frame_pixels.copy()
+            for left, top, right, bottom in overlaps:
+                frame_pixels[top - fy:bottom - fy, left - fx:right - fx] = 255
+
+        frame = Frame(x + fx, y + fy, frame_pixels)
         frames.append(frame)
+        masks.append((fx, fy, fw, fh))
         draw.rectangle([fx, fy, fx + fw, fy + fh], fill=(255, 255, 255))
 
     # Consider base image as a frame
@@ -508,12 +813,52 @@ def get_frames(x: int, y: int, image: PIL.Image.Image) -> list[Frame]:
     return frames
 
 
+def _tree_revision(frames: list[Frame]) -> int:
+    # Latest revision of any frame in the tree, frames are revised on every change
+    revision = 0
+    stack = list(frames)
+    while stack:
+        frame = stack.pop()
+        revision = max(revision, frame._revision)
+        stack.extend(frame.subframes)
+    return revision
+
+
+def _observe_leaf(frame: Frame, index: int) -> tuple[list[PIL.Image.Image], list[str], set[str]]:
+    # Reuse the images and captions of a leaf frame unless it changed or moved to another index
+    cached = frame._leaf_observation
+    if cached and cached[:2] == (frame._revision, index):
+        return cached[2]
+
+    images = []
+    image_captions = []
+    interactables = set()
+
+    frame_interactable = ""
+    if frame.interactable:
+        interactables.add(frame.interactable)
+        frame_interactable = f": {frame.interactable}"
+    
+    image_captions.append(f"Frame {index}{frame_interactable}")
+    images.append(frame.image)
+    
+    for element_index, element in enumerate(frame.interactables):
+        interactables.add(element.interactable)
+        image_captions.append(f"Frame {index} Interactable {element_index}: {element.interactable}")
+        images.append(element.image)
+
+    frame._leaf_observation = (frame._revision, index, (images, image_captions, interactables))
+    return images, image_captions, interactables
+
+
 def get_observation(frames: list[Frame]) -> tuple[
     list[Frame], list[PIL.Image.Image], list[str], list[str], list[str], set[str]
 ]:
     """
     Get the frame images, interactable element images, image descriptions, and frame relations.
     These constitute the VLM agent's observation of the environment.
+    The observation is cached on the frames and rebuilt only after they change
+    (`describe`/`relate`, `split`, `grid`, `set_frame_as`, `set_element_as`).
     
     Args:
     - frames (List[Frame]): A list of Frame objects representing the environment.
@@ -527,7 +872,23 @@ def get_observation(frames: list[Frame]) -> tuple[
     - List of descriptions for each frame
     - List of unique interactable types
     """
+    if not frames: return [], [], [], [], [], set()
+
+    key = (tuple(id(frame) for frame in frames), _tree_revision(frames))
+    cached = frames[0]._observation
+    if cached is None or cached[0] != key:
+        cached = key, _observe(frames)
+        frames[0]._observation = cached
+
+    # Callers get their own lists, the cached observation stays intact
+    all_frames, images, image_captions, descriptions, relations, interactables = cached[1]
+    return list(all_frames), list(images), list(image_captions), list(descriptions), list(relations), set(interactables)
+
 
+@Metrics.timed("halligan_layout_seconds", op="observe")
+def _observe(frames: list[Frame]) -> tuple[
+    list[Frame], list[PIL.Image.Image], list[str], list[str], list[str], set[str]
+]:
     # Step 1: Traverse frames and retrieve images, captions, and index ranges.
     # Only leaf nodes (frames without subframes) and their interactable elements are considered.
     all_frames = []
@@ -547,18 +908,10 @@ def get_observation(frames: list[Frame]) -> tuple[
 
         else:
             all_frames.append(frame)
-            frame_interactable = ""
-            if frame.interactable:
-                interactables.add(frame.interactable)
-                frame_interactable = f": {frame.interactable}"
-            
-            image_captions.append(f"Frame {global_index}{frame_interactable}")
-            images.append(frame.image)
-            
-            for element_index, element in enumerate(frame.interactables):
-                interactables.add(element.interactable)
-                image_captions.append(f"Frame {global_index} Interactable {element_index}: {element.interactable}")
-                images.append(element.image)
+            leaf_images, leaf_captions, leaf_interactables = _observe_leaf(frame, global_index)
+            images.extend(leaf_images)
+            image_captions.extend(leaf_captions)
+            interactables.update(leaf_interactables)
 
             if not global_index_ranges[frame_index]:
                 # Initialize the index range with (start, end) as the same global index
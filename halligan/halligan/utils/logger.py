@@ -1,8 +1,7 @@
-import io
 import os
 import sys
-import base64
 import hashlib
+import inspect
 import platform
 from pathlib import Path
 from timeit import default_timer as timer
@@ -12,6 +11,8 @@ from importlib.metadata import distributions
 import nbformat as nbf
 import PIL.Image
 
+from halligan.utils.encoding import default_encoder
+
 
 def get_python_version() -> str:
     version_info = sys.version_info
@@ -28,10 +29,8 @@ def get_python_env_hash() -> str:
 
 
 def get_image_tag(image: PIL.Image.Image) -> str:
-    buffer = io.BytesIO()
-    image.save(buffer, format="PNG")
-    image_b64 = base64.b64encode(buffer.getvalue()).decode()
-    return f'<img src="data:image/png;base64,{image_b64}"/>'
+    # Reuse the (memoized) payload that is sent to the agent
+    return f'<img src="{default_encoder.encode(image)}"/>'
 
 
 def get_image_grid(images: list[PIL.Image.Image], image_captions: list[str], columns = 5) -> str:
@@ -81,32 +80,44 @@ class Trace:
 
     @classmethod
     def agent(cls):
+        def record(prompt, images, image_captions, response, metadata, execution_time):
+            prompt_cell = nbf.v4.new_code_cell(source=f"PROMPT = '''\n{prompt}\n'''")
+            images_cell = nbf.v4.new_code_cell(source=f"IMAGES = {len(images)}", outputs=[
+                nbf.v4.new_output(
+                    output_type="display_data",
+                    data={"text/html": get_image_grid(images, image_captions)},
+                    metadata={}
+                )
+            ])
+
+            source = "\n".join(f"{key.upper()} = {value}" for key, value in metadata.items())
+            source = f"RESPONSE = '''\n{response}\n'''\nTIME = {execution_time}\n" + source
+            response_cell = nbf.v4.new_code_cell(source=source)
+            divider_cell = nbf.v4.new_markdown_cell(f"---")
+            cls.cells.extend([prompt_cell, images_cell, response_cell, divider_cell])
+
+            return response, metadata
+
         def decorator(func):
-            def wrapper(self, prompt: str, images: list[PIL.Image.Image] = [], image_captions: list[str] = []):
+            if inspect.iscoroutinefunction(func):
+                async def wrapper(self, prompt: str, images: list[PIL.Image.Image] = [], image_captions: list[str] = [], **kwargs):
+                    if not cls.tracing:
+                        return await func(self, prompt, images, image_captions, **kwargs)
+
+                    start_time = timer()
+                    response, metadata = await func(self, prompt, images, image_captions, **kwargs)
+                    end_time = timer()
+                    return record(prompt, images, image_captions, response, metadata, end_time - start_time)
+                return wrapper
+
+            def wrapper(self, prompt: str, images: list[PIL.Image.Image] = [], image_captions: list[str] = [], **kwargs):
                 if not cls.tracing:
-                    return func(self, prompt, images, image_captions)
+                    return func(self, prompt, images, image_captions, **kwargs)
 
                 start_time = timer()
-                response, metadata = func(self, prompt, images, image_captions)
+                response, metadata = func(self, prompt, images, image_captions, **kwargs)
                 end_time = timer()
-                execution_time = end_time - start_time
-
-                prompt_cell = nbf.v4.new_code_cell(source=f"PROMPT = '''\n{prompt}\n'''")
-                images_cell = nbf.v4.new_code_cell(source=f"IMAGES = {len(images)}", outputs=[
-                    nbf.v4.new_output(
-                        output_type="display_data", 
-                        data={"text/html": get_image_grid(images, image_captions)}, 
-                        metadata={}
-                    )
-                ])
-
-                metadata = "\n".join(f"{key.upper()} = {value}" for key, value in metadata.items())
-                response = f"RESPONSE = '''\n{response}\n'''\nTIME = {execution_time}\n" + metadata
-                response_cell = nbf.v4.new_code_cell(source=response)
-                divider_cell = nbf.v4.new_markdown_cell(f"---")
-                cls.cells.extend([prompt_cell, images_cell, response_cell, divider_cell])
-
-                return response, metadata
+                return record(prompt, images, image_captions, response, metadata, end_time - start_time)
             return wrapper
         return decorator   
 
@@ -0,0 +1,144 @@
+import os
+import math
+import threading
+import functools
+from collections import defaultdict
+from timeit import default_timer as timer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+Series = tuple[str, tuple[tuple[str, str], ...]]
+
+
+def _series(name: str, labels: dict[str, str]) -> Series:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format(name: str, labels: tuple[tuple[str, str], ...], value: float, **extra: str) -> str:
+    labels = labels + tuple(extra.items())
+    if not labels: return f"{name} {value}"
+    label_str = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return f"{name}{{{label_str}}} {value}"
+
+
+def quantile(values: list[float], q: float) -> float:
+    # Nearest-rank quantile over sorted values
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+class Metrics:
+    # Labels attached to every recorded sample (e.g. the CAPTCHA type of the current episode)
+    labels: dict[str, str] = {}
+
+    _counters: dict[Series, float] = defaultdict(float)
+    _latencies: dict[Series, list[float]] = defaultdict(list)
+    _lock = threading.Lock()
+
+    @classmethod
+    def start(cls, **labels: str) -> None:
+        """
+        Start recording an episode, `labels` are attached to all samples until the next start.
+        """
+        cls.labels = labels
+
+    @classmethod
+    def increment(cls, name: str, value: float = 1, **labels: str) -> None:
+        with cls._lock:
+            cls._counters[_series(name, {**cls.labels, **labels})] += value
+
+    @classmethod
+    def observe(cls, name: str, seconds: float, **labels: str) -> None:
+        with cls._lock:
+            cls._latencies[_series(name, {**cls.labels, **labels})].append(seconds)
+
+    @classmethod
+    def timed(cls, name: str, **labels: str):
+        """
+        Record the latency of every call to the decorated function.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start_time = timer()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    cls.observe(name, timer() - start_time, **labels)
+            return wrapper
+        return decorator
+
+    @classmethod
+    def export(cls) -> str:
+        """
+        Export all metrics in the Prometheus text format.
+        Latencies are exported as summaries with p50/p95/p99 quantiles.
+        """
+        lines = []
+        with cls._lock:
+            counters = dict(cls._counters)
+            latencies = {series: sorted(values) for series, values in cls._latencies.items()}
+
+        for metric in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {metric} counter")
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric: lines.append(_format(name, labels, value))
+
+        for metric in sorted({name for name, _ in latencies}):
+            lines.append(f"# TYPE {metric} summary")
+            for (name, labels), values in sorted(latencies.items()):
+                if name != metric or not values: continue
+                for q in QUANTILES:
+                    lines.append(_format(name, labels, quantile(values, q), quantile=str(q)))
+                lines.append(_format(f"{name}_sum", labels, sum(values)))
+                lines.append(_format(f"{name}_count", labels, len(values)))
+
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def write(cls, path: str) -> None:
+        """
+        Write metrics to a Prometheus text file (e.g. for the node exporter textfile collector).
+        """
+        directory = os.path.dirname(path)
+        if directory: os.makedirs(directory, exist_ok=True)
+        temp = f"{path}.tmp"
+        with open(temp, "w") as f:
+            f.write(cls.export())
+        os.replace(temp, path)
+
+    @classmethod
+    def serve(cls, port: int = 9464, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """
+        Serve metrics at http://host:port/metrics from a daemon thread.
+        """
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = cls.export().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    @classmethod
+    def reset(cls) -> None:
+        with cls._lock:
+            cls._counters.clear()
+            cls._latencies.clear()
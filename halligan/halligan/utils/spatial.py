@@ -0,0 +1,80 @@
+from collections import defaultdict
+
+import numpy as np
+
+
+class GridIndex:
+    def __init__(self, points: np.ndarray, cell_size: float = 64) -> None:
+        """
+        Spatial index of points (x, y), bucketed into square cells of `cell_size` pixels.
+        Region and nearest neighbour queries only visit the cells around the query instead of every point.
+        """
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = float(cell_size)
+
+        cells = np.floor(self.points / self.cell_size).astype(int)
+        buckets = defaultdict(list)
+        for i, cell in enumerate(map(tuple, cells.tolist())):
+            buckets[cell].append(i)
+        self._buckets = {cell: np.array(indices) for cell, indices in buckets.items()}
+
+        # Range of occupied cells, queries are clipped to it
+        self._low = cells.min(axis=0) if len(cells) else np.zeros(2, int)
+        self._high = cells.max(axis=0) if len(cells) else np.full(2, -1)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def _cell(self, x: float, y: float) -> tuple[int, int]:
+        return int(np.floor(x / self.cell_size)), int(np.floor(y / self.cell_size))
+
+    def _gather(self, cells) -> np.ndarray:
+        indices = [self._buckets[cell] for cell in cells if cell in self._buckets]
+        return np.concatenate(indices) if indices else np.empty(0, int)
+
+    def within(self, bbox: tuple[float, float, float, float]) -> np.ndarray:
+        """
+        Indices (ascending) of the points inside bbox (xmin, ymin, xmax, ymax), borders included.
+        """
+        xmin, ymin, xmax, ymax = bbox
+        (cx0, cy0), (cx1, cy1) = self._cell(xmin, ymin), self._cell(xmax, ymax)
+        cx0, cy0 = max(cx0, self._low[0]), max(cy0, self._low[1])
+        cx1, cy1 = min(cx1, self._high[0]), min(cy1, self._high[1])
+
+        candidates = self._gather((i, j) for i in range(cx0, cx1 + 1) for j in range(cy0, cy1 + 1))
+        x, y = self.points[candidates].T
+        inside = (xmin <= x) & (x <= xmax) & (ymin <= y) & (y <= ymax)
+        return np.sort(candidates[inside])
+
+    def nearest(self, x: float, y: float, k: int = 1) -> np.ndarray:
+        """
+        Indices of the (up to) k points closest to (x, y), nearest first.
+        Searches rings of cells around the query and stops once no unvisited cell can hold a closer point.
+        """
+        if not len(self) or k <= 0: return np.empty(0, int)
+
+        cx, cy = self._cell(x, y)
+        max_ring = int(max(
+            abs(cx - self._low[0]), abs(cx - self._high[0]),
+            abs(cy - self._low[1]), abs(cy - self._high[1])
+        ))
+
+        found = []
+        for ring in range(max_ring + 1):
+            if ring == 0:
+                cells = [(cx, cy)]
+            else:
+                cells = [(cx + i, cy + j) for i in range(-ring, ring + 1) for j in (-ring, ring)]
+                cells += [(cx + i, cy + j) for i in (-ring, ring) for j in range(-ring + 1, ring)]
+            found.append(self._gather(cells))
+
+            # Points in unvisited rings are at least `ring` cells away
+            candidates = np.concatenate(found)
+            if len(candidates) >= k:
+                distances = np.hypot(*(self.points[candidates] - (x, y)).T)
+                if np.sort(distances)[k - 1] <= ring * self.cell_size: break
+
+        candidates = np.concatenate(found)
+        distances = np.hypot(*(self.points[candidates] - (x, y)).T)
+        order = np.lexsort((candidates, distances))
+        return candidates[order[:k]]
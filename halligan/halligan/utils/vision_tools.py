@@ -4,8 +4,10 @@
 import os
 import re
 import random
-import itertools
-from typing import List, Any
+import threading
+from typing import List, Any, Optional
+from collections.abc import Sequence
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 
 import cv2
@@ -13,24 +15,131 @@ import numpy as np
 import PIL.Image
 from PIL import ImageDraw
 from dotenv import load_dotenv
-from skimage.color import rgb2lab, deltaE_cie76
+from skimage.color import rgb2lab
 
-from halligan.agents import GPTAgent
-from halligan.models import Detector
+from halligan.agents import AgentPool, ResponseCache, RetryPolicy
+from halligan.models import CLIP, Detector
 from halligan.utils.toolkit import Toolkit
-from halligan.utils.layout import Frame, Element, Point
+from halligan.utils.metrics import Metrics
+from halligan.utils.cache import LRUCache, image_hash
+from halligan.utils.layout import Frame, Element, Point, _text_features
 
 
 load_dotenv()
-agent = GPTAgent(api_key=os.getenv("OPENAI_API_KEY"))
+# Stateless agents shared by all tools, safe to use from concurrent episodes and threads
+agent_pool = AgentPool(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    size=int(os.getenv("VLM_POOL_SIZE", 8)),
+    cache=ResponseCache(bypass=os.getenv("VLM_CACHE_BYPASS") == "1"),
+    retry=RetryPolicy.from_env()
+)
 
+# Maximum number of images in one merged `ask_many` request
+ASK_BATCH_IMAGES = 20
 
+# Detected bounding boxes by (image content, prompt, detector), shared by `mark` and `focus`.
+# Bump the version when the detector model changes.
+DETECTOR_VERSION = "v1"
+detection_cache = LRUCache(capacity=1024)
+
+# Questions deferred by `batch()` in each thread
+_batches = threading.local()
+
+# Number of images ranked together in one `rank` request, and the number of images shortlisted
+# by local CLIP pre-scoring before any request is made (0 ranks all images)
+RANK_BATCH_SIZE = int(os.getenv("RANK_BATCH_SIZE", 10))
+RANK_SHORTLIST = int(os.getenv("RANK_SHORTLIST", 0))
+
+# Maximum number of candidate images compared with the reference in one `compare` request
+COMPARE_CHUNK_SIZE = int(os.getenv("COMPARE_CHUNK_SIZE", 10))
+
+# Images whose difference hashes are within this many bits (of 64) may be duplicates, -1 disables deduplication.
+# Candidates must also have nearly equal pixels (mean absolute difference up to DEDUPE_TOLERANCE).
+DEDUPE_DISTANCE = int(os.getenv("DEDUPE_DISTANCE", 4))
+DEDUPE_TOLERANCE = 1.0
+
+
+def _prescore(images: list[PIL.Image.Image], text: str) -> np.ndarray:
+    """
+    Cosine similarity of each image to the text in CLIP space, a cheap local relevance score.
+    """
+    image_features = np.asarray(CLIP.get_image_features(images), dtype=np.float32)
+    image_features /= np.linalg.norm(image_features, ord=2, axis=-1, keepdims=True)
+    return image_features @ _text_features([text])[0]
+
+
+def _dhash(image: PIL.Image.Image) -> int:
+    # 64-bit difference hash: whether each pixel of a 9 x 8 thumbnail is brighter than its left neighbour
+    thumbnail = np.asarray(image.convert("L").resize((9, 8), PIL.Image.Resampling.BILINEAR), dtype=np.int16)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _dedupe(images: list[PIL.Image.Image]) -> tuple[list[PIL.Image.Image], list[int]]:
+    """
+    Collapse near-duplicate images, e.g. screenshots taken while a slider moved but the frame did not change.
+    Returns the distinct images, and for each image the index of its distinct image.
+    """
+    if DEDUPE_DISTANCE < 0 or len(images) < 2:
+        return list(images), list(range(len(images)))
+
+    unique, hashes, pixels, index = [], [], [], []
+    for image in images:
+        image_dhash = _dhash(image)
+        image_pixels = np.asarray(image, dtype=np.int16)
+        for j, (unique_dhash, unique_pixels) in enumerate(zip(hashes, pixels)):
+            if (
+                (image_dhash ^ unique_dhash).bit_count() <= DEDUPE_DISTANCE and
+                image_pixels.shape == unique_pixels.shape and
+                np.abs(image_pixels - unique_pixels).mean() <= DEDUPE_TOLERANCE
+            ):
+                index.append(j)
+                break
+        else:
+            index.append(len(unique))
+            unique.append(image)
+            hashes.append(image_dhash)
+            pixels.append(image_pixels)
+
+    Metrics.increment("halligan_vlm_deduped_images_total", len(images) - len(unique))
+    return unique, index
+
+
+def _dedupe_question(images: list[PIL.Image.Image], answer_type: str) -> tuple[list[PIL.Image.Image], list[int]]:
+    # Numbers may name images by position (e.g. "Which image ...?"), so those questions see every image
+    if answer_type == "int": return list(images), list(range(len(images)))
+    return _dedupe(images)
+
+
+def _expand(answers: list[Any], index: list[int], unique: int) -> list[Any]:
+    # Give every image the answer of its distinct image, answers that are not one per image are kept as is
+    if len(answers) != unique or len(index) == unique: return answers
+    return [answers[j] for j in index]
+
+
+def _detect(images: list[PIL.Image.Image], prompt: str) -> list[list]:
+    """
+    `Detector.detect` with cached results, only images that were not seen with this prompt are detected (in one batch).
+    """
+    keys = [(image_hash(image), prompt, DETECTOR_VERSION) for image in images]
+    results = {key: detection_cache.get(key) for key in keys}
+
+    misses = {key: image for key, image in zip(keys, images) if results[key] is None}
+    if misses:
+        for key, bboxes in zip(misses, Detector.detect(list(misses.values()), prompt)):
+            results[key] = bboxes
+            detection_cache.put(key, bboxes)
+
+    return [results[key] for key in keys]
+
+
+@Metrics.timed("halligan_tool_seconds", tool="mark")
 def mark(images: list[PIL.Image.Image], object: str) -> list[PIL.Image.Image]:
     """
     Annotate object bounding boxes in each image.
     Helps answer questions that require counting and finding objects.
     """
-    all_bboxes = Detector.detect(images, object)
+    all_bboxes = _detect(images, object)
 
     annotated_images = []
     for image, bboxes in zip(images, all_bboxes):
@@ -40,8 +149,10 @@ def mark(images: list[PIL.Image.Image], object: str) -> list[PIL.Image.Image]:
             if (bbox[2] - bbox[0]) / img_width >= 0.125 and (bbox[3] - bbox[1]) / img_height >= 0.125
         ]
 
+        # Annotate a copy, the original stays unmarked for later tools (and detection cache hits)
+        image = image.copy()
+        draw = ImageDraw.Draw(image)
         for bbox in bboxes:
-            draw = ImageDraw.Draw(image)
             draw.rectangle(bbox, outline="red", width=2)
         
         annotated_images.append(image)
@@ -49,22 +160,21 @@ def mark(images: list[PIL.Image.Image], object: str) -> list[PIL.Image.Image]:
     return annotated_images
 
 
+@Metrics.timed("halligan_tool_seconds", tool="focus")
 def focus(image: PIL.Image.Image, description: str) -> list[PIL.Image.Image]:
     """
     Zooms in on specific regions of the image that matches description.
     Helps answer questions that require detailed visual analysis.
     Returns a list of focused regions.
     """
-    bboxes = Detector.detect([image], description)[-1]
+    bboxes = _detect([image], description)[-1]
     zoomed_regions = [image.crop(bbox) for bbox in bboxes]   
     return zoomed_regions
 
 
-def ask(images: list[PIL.Image.Image], question: str, answer_type: str) -> list[Any]:
+def _answer_spec(answer_type: str) -> tuple[str, str, re.Pattern]:
     """
-    Ask a question about the visual state of a batch of images.
-    `answer_type` can be `bool`, `int`, `str`.
-    Returns answers (list[Any]), a list of `answer_type` outputs for each image.
+    Get the answer format, format example and parsing pattern of an `answer_type`.
     """
     if answer_type == "int":
         answer_format = "numbers"
@@ -78,7 +188,11 @@ def ask(images: list[PIL.Image.Image], question: str, answer_type: str) -> list[
         answer_format = "(True/False)"
         answers_format = "answer(booleans=[True, False, ...])"
         answer_pattern = re.compile(r'answer\((booleans=)?(\[(True|False)(,\s*(True|False))*\])\)')
-     
+
+    return answer_format, answers_format, answer_pattern
+
+
+def _ask_hint(question: str) -> str:
     hint = ""
     if any(keyword in question.lower() for keyword in ["path", "direction"]):
         hint = (
@@ -95,6 +209,43 @@ def ask(images: list[PIL.Image.Image], question: str, answer_type: str) -> list[
             f"3. You should use the red boxes as a reference rather than ground truth."
         )
 
+    return hint
+
+
+def _parse_answers(response: str, question: str, answer_type: str) -> Optional[list[Any]]:
+    """
+    Parse the answers to `question` from `response`, returns None if there are no answers.
+    """
+    _, _, answer_pattern = _answer_spec(answer_type)
+    match = re.search(answer_pattern, response)
+    if not match: return None
+
+    matches = eval(match.group(2))
+    if "point to the letter" in question.lower(): matches = [7]
+    if "point to the object directly below the letter" in question.lower(): matches = [11]
+    return matches
+
+
+def ask(images: list[PIL.Image.Image], question: str, answer_type: str) -> list[Any]:
+    """
+    Ask a question about the visual state of a batch of images.
+    `answer_type` can be `bool`, `int`, `str`.
+    Returns answers (list[Any]), a list of `answer_type` outputs for each image.
+    """
+    pending: Optional[_Batch] = getattr(_batches, "current", None)
+    if pending is not None:
+        return pending.add(images, question, answer_type)
+
+    return _ask(images, question, answer_type)
+
+
+# Timed apart from `ask`, so questions deferred by `batch()` are not recorded as instant asks
+@Metrics.timed("halligan_tool_seconds", tool="ask")
+def _ask(images: list[PIL.Image.Image], question: str, answer_type: str) -> list[Any]:
+    images, index = _dedupe_question(images, answer_type)
+    answer_format, answers_format, _ = _answer_spec(answer_type)
+    hint = _ask_hint(question)
+
     prompt = (
         f"## Objective\n"
         f"Given the list of images, answer the question: {question}\n"
@@ -103,19 +254,152 @@ def ask(images: list[PIL.Image.Image], question: str, answer_type: str) -> list[
         f"{hint}"
     )
     image_captions = [f"Image {i}" for i in range(len(images))]
-    response, _ = agent(prompt, images, image_captions)
-    agent.reset()
-    match = re.search(answer_pattern, response)
-    if match:
-        matches = eval(match.group(2))
-        if "point to the letter" in question.lower(): matches = [7]
-        if "point to the object directly below the letter" in question.lower(): matches = [11]
-    else:
+    response, _ = agent_pool(prompt, images, image_captions)
+    matches = _parse_answers(response, question, answer_type)
+    if matches is None:
         matches = [False] * len(images) if answer_type == "bool" else [0] * len(images)
 
-    return matches
+    return _expand(matches, index, len(images))
 
 
+@Metrics.timed("halligan_tool_seconds", tool="ask_many")
+def ask_many(queries: list[tuple[list[PIL.Image.Image], str, str]]) -> list[list[Any]]:
+    """
+    Ask several questions at once, each is an (images, question, answer_type) tuple as in `ask`.
+    Questions are merged into as few requests as possible.
+    Returns a list of answers (list[Any]) for each question.
+    """
+    # Ask about each distinct image once
+    deduped = [_dedupe_question(images, answer_type) for images, _, answer_type in queries]
+    queries = [(images, question, answer_type) for (images, _), (_, question, answer_type) in zip(deduped, queries)]
+
+    # Group questions into requests with a bounded number of images
+    groups: list[list[int]] = []
+    group_images = 0
+    for i, (images, _, _) in enumerate(queries):
+        if not groups or group_images + len(images) > ASK_BATCH_IMAGES:
+            groups.append([])
+            group_images = 0
+        groups[-1].append(i)
+        group_images += len(images)
+
+    calls = []
+    for group in groups:
+        questions, hints = [], []
+        group_images, image_captions = [], []
+        for q, i in enumerate(group):
+            images, question, answer_type = queries[i]
+            answer_format, answers_format, _ = _answer_spec(answer_type)
+            questions.append(
+                f"Question {q}: {question}\n"
+                f"Output a list of {answer_format} for each image of Question {q}, "
+                f"following the format `{answers_format}`."
+            )
+            hint = _ask_hint(question)
+            if hint and hint not in hints: hints.append(hint)
+            group_images.extend(images)
+            image_captions.extend(f"Question {q} Image {j}" for j in range(len(images)))
+
+        questions, hints = "\n".join(questions), "\n".join(hints)
+        prompt = (
+            f"## Objective\n"
+            f"Answer each question about its own list of images.\n"
+            f"{questions}\n"
+            f"Answer each question on its own line, prefixed with its id (e.g. `Question 0: answer(...)`).\n"
+            f"{hints}"
+        )
+        calls.append((prompt, group_images, image_captions))
+
+    responses = agent_pool.map(calls)
+
+    # Scatter the answers back to each question
+    answers: list[list[Any]] = [None] * len(queries)
+    for group, (response, _) in zip(groups, responses):
+        sections = re.split(r'Question (\d+):', response)
+        sections = {int(q): section for q, section in zip(sections[1::2], sections[2::2])}
+        for q, i in enumerate(group):
+            images, question, answer_type = queries[i]
+            if q in sections:
+                answers[i] = _parse_answers(sections[q], question, answer_type)
+
+    # Fall back to asking separately if the merged response could not be parsed
+    for i, (images, question, answer_type) in enumerate(queries):
+        if answers[i] is None:
+            answers[i] = ask(images, question, answer_type)
+
+    return [_expand(answer, index, len(images)) for answer, (images, index) in zip(answers, deduped)]
+
+
+class _DeferredAnswers(Sequence):
+    def __init__(self, batch: "_Batch") -> None:
+        """
+        Answers of an `ask` made inside `batch()`, resolved when the batch is flushed.
+        Reading the answers before the block ends flushes all pending questions early.
+        """
+        self._batch = batch
+        self._answers: Optional[list[Any]] = None
+
+    def _resolve(self) -> list[Any]:
+        if self._answers is None: self._batch.flush()
+        return self._answers
+
+    def __getitem__(self, index):
+        return self._resolve()[index]
+
+    def __len__(self) -> int:
+        return len(self._resolve())
+
+    def __eq__(self, other) -> bool:
+        return self._resolve() == (list(other) if isinstance(other, Sequence) else other)
+
+    def __repr__(self) -> str:
+        return repr(self._resolve())
+
+
+class _Batch:
+    def __init__(self) -> None:
+        self.queries: list[tuple[list[PIL.Image.Image], str, str]] = []
+        self.deferred: list[_DeferredAnswers] = []
+
+    def add(self, images: list[PIL.Image.Image], question: str, answer_type: str) -> _DeferredAnswers:
+        deferred = _DeferredAnswers(self)
+        self.queries.append((images, question, answer_type))
+        self.deferred.append(deferred)
+        return deferred
+
+    def flush(self) -> None:
+        queries, deferred = self.queries, self.deferred
+        self.queries, self.deferred = [], []
+        if not queries: return
+
+        # Answer outside the batch, so fallback asks are not deferred again
+        current, _batches.current = _batches.current, None
+        try:
+            for answers, result in zip(deferred, ask_many(queries)):
+                answers._answers = result
+        finally:
+            _batches.current = current
+
+
+@contextmanager
+def batch():
+    """
+    Defer every `ask` inside the block and answer them together with `ask_many` when the block ends.
+    Example:
+        with batch():
+            answers = [ask([choice.image], "Is the die showing 6?", "bool") for choice in choices]
+    """
+    pending = _Batch()
+    previous = getattr(_batches, "current", None)
+    _batches.current = pending
+    try:
+        yield pending
+    finally:
+        _batches.current = previous
+        pending.flush()
+
+
+@Metrics.timed("halligan_tool_seconds", tool="rank")
 def rank(images: list[PIL.Image.Image], task_objective: str) -> list[str]:
     """
     Ranks each image in the `images` list based on the specified criteria in `task_objective`.
@@ -141,10 +425,7 @@ def rank(images: list[PIL.Image.Image], task_objective: str) -> list[str]:
         traverse(root)
         return result
     
-    def get_top_rank(prompt, batch_image, batch_captions):
-        # Get ranking
-        response, _ = agent(prompt, batch_image, batch_captions)
-        #agent.reset()
+    def get_top_rank(response, batch):
         match = re.search(r'rank\((ids=)?(\[[\d, ]+\])\)', response)
 
         print(response)
@@ -155,17 +436,26 @@ def rank(images: list[PIL.Image.Image], task_objective: str) -> list[str]:
         best_id = batch[ranking[0]].id
         best_node = Node(best_id)
         best_node.children = [batch[i] for i in ranking]
-
-        agent.reset()
         return best_node
 
-    # To prevent agent from being overwhelmed, batch the input images
-
     print("all images", len(images))
+    if not images: return []
+
+    # Rank each distinct image once, duplicates follow the image they duplicate
+    images, index = _dedupe(images)
+    duplicates = [[] for _ in images]
+    for i, j in enumerate(index): duplicates[j].append(i)
+
+    # Optionally shortlist the most relevant images locally, the rest follow in pre-score order
+    ids, rest = list(range(len(images))), []
+    if 0 < RANK_SHORTLIST < len(images):
+        order = np.argsort(-_prescore(images, task_objective), kind="stable").tolist()
+        ids, rest = order[:RANK_SHORTLIST], order[RANK_SHORTLIST:]
 
-    batch_size = 10
-    nodes = [Node(i) for i in range(len(images))]
-    batches = [nodes[i:i+batch_size] for i in range(0, len(images), batch_size)]
+    # To prevent agent from being overwhelmed, batch the input images
+    batch_size = RANK_BATCH_SIZE
+    nodes = [Node(i) for i in ids]
+    batches = [nodes[i:i+batch_size] for i in range(0, len(nodes), batch_size)]
     hint = ""
     if any(keyword in task_objective.lower() for keyword in ["complete the puzzle", "missing spot"]):
         hint = (
@@ -187,36 +477,37 @@ def rank(images: list[PIL.Image.Image], task_objective: str) -> list[str]:
             f"1. Find the image that is the least tiled (the upright image)."
         )
 
+    prompt = (
+        f"Given a list of images, "
+        f"rank them based on their relevance to the objective: {task_objective}.\n"
+        f"You should follow the format rank(ids=[1, 2, ...]) to output a ranked list of image ids.\n"
+        f"{hint}"
+    )
+
     # Perform tournament-based ranking on the batches.
     # The best (rank #1) image from each batch is selected to form a new batch for the next round.
+    # Batches within a round are independent, so they are ranked concurrently.
+    # A single image left over in a batch wins it without a request.
     root = None
     while True:
-        next_batch = []
-
-        print(next_batch)
-
-        for batch in batches:
-            # Prepare input
-            prompt = (
-                f"Given a list of images, "
-                f"rank them based on their relevance to the objective: {task_objective}.\n"
-                f"You should follow the format rank(ids=[1, 2, ...]) to output a ranked list of image ids.\n"
-                f"{hint}"
-            )
-            batch_captions = [f"Image {i}" for i in range(len(batch))]
-            batch_image = [images[node.id] for node in batch]
-            best_node = get_top_rank(prompt, batch_image, batch_captions)
-            next_batch.append(best_node)
+        calls = [
+            (prompt, [images[node.id] for node in batch], [f"Image {i}" for i in range(len(batch))])
+            for batch in batches if len(batch) > 1
+        ]
+        responses = iter(agent_pool.map(calls))
+        next_batch = [get_top_rank(next(responses)[0], batch) if len(batch) > 1 else batch[0] for batch in batches]
 
         if len(next_batch) == 1: 
-            root = best_node
+            root = next_batch[0]
             break
 
-        batches = [next_batch]
+        # Winners are batched again, so a round never exceeds the batch size
+        batches = [next_batch[i:i+batch_size] for i in range(0, len(next_batch), batch_size)]
         
-    return preorder(root)
+    return [i for j in preorder(root) + rest for i in duplicates[j]]
 
 
+@Metrics.timed("halligan_tool_seconds", tool="compare")
 def compare(images: list[PIL.Image.Image], task_objective: str, reference: PIL.Image.Image = None) -> list[bool]:
     """
     Compare each image with the `reference` image and check if it satisfies `task_objective`.
@@ -227,7 +518,10 @@ def compare(images: list[PIL.Image.Image], task_objective: str, reference: PIL.I
     answer_pattern = re.compile(r'answer\((booleans=)?(\[(True|False)(,\s*(True|False))*\])\)')
 
     hint = ""
+    # Objectives with exactly one matching image, all images must be judged together
+    single_answer = False
     if any(keyword in task_objective.lower() for keyword in ["direction"]):
+        single_answer = True
         hint = (
             f"## Guidelines\n"
             f"1. First, find the orientation of the fingers in reference, there are two stretched fingers, which are thinner relative to the wrist\n"
@@ -237,6 +531,7 @@ def compare(images: list[PIL.Image.Image], task_objective: str, reference: PIL.I
             f"5. There should only be one True value."
         )
     if any(keyword in task_objective.lower() for keyword in ["orbit"]):
+        single_answer = True
         hint = (
             f"## Guidelines\n"
             f"1. First, describe the icons from top to bottom in each image.\n"
@@ -264,96 +559,116 @@ def compare(images: list[PIL.Image.Image], task_objective: str, reference: PIL.I
         f"{hint}"
     )
 
-    images = [reference] + images
-    image_captions = ["Reference"] + [f"Item {i}" for i in range(len(images))]
-    response, _ = agent(prompt, images, image_captions)
-
-    agent.reset()
-    match = re.search(answer_pattern, response)
-    matches = eval(match.group(2)) if match else [False] * (len(images) - 1)
+    # Compare each distinct image once, in chunks that each include the reference, sent concurrently.
+    # A single answer is only meaningful over all images, so those are sent in one request.
+    images, index = _dedupe(images)
+    chunk_size = max(1, len(images)) if single_answer else COMPARE_CHUNK_SIZE
+    chunks = [images[i:i + chunk_size] for i in range(0, len(images), chunk_size)]
+    calls = [
+        (prompt, [reference] + chunk, ["Reference"] + [f"Item {i}" for i in range(len(chunk))])
+        for chunk in chunks
+    ]
+
+    matches = []
+    for chunk, (response, _) in zip(chunks, agent_pool.map(calls)):
+        match = re.search(answer_pattern, response)
+        chunk_matches = eval(match.group(2)) if match else []
+        # One answer per item, missing answers are False
+        matches.extend((chunk_matches + [False] * len(chunk))[:len(chunk)])
+
+    return _expand(matches, index, len(images))
+
+
+@dataclass
+class _Descriptors:
+    # Contours of the Otsu-thresholded image, and Hu moments of all but the largest (by descending area)
+    contours: int
+    hu_moments: np.ndarray
+    # Lab colors of the 10-color median cut palette, and the sum of distances between them
+    palette: np.ndarray
+    intra_dist: float
+
+
+def _color_dist(lab1: np.ndarray, lab2: np.ndarray) -> np.ndarray:
+    # CIE76 color difference, scaled to [0, 1]
+    return np.minimum(np.linalg.norm(lab1 - lab2, axis=-1) / 100.0, 1.0)
+
+
+def _descriptors(element: Element) -> _Descriptors:
+    if element._descriptors is not None:
+        return element._descriptors
+
+    gray = cv2.cvtColor(element.array, cv2.COLOR_RGB2GRAY)
+    _, threshold = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(threshold, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    contours = sorted(contours, key=cv2.contourArea, reverse=True)
+    hu_moments = np.array([cv2.HuMoments(cv2.moments(contour)).flatten() for contour in contours[1:]])
+
+    palette = element.image.quantize(
+        colors=10, 
+        method=PIL.Image.Quantize.MEDIANCUT, 
+        dither=PIL.Image.Dither.NONE, 
+        kmeans=0
+    ).getpalette()[:30]
+
+    # Images with fewer colors have shorter palettes, the missing colors are black
+    palette = np.array(palette + [0] * (30 - len(palette)), dtype=np.float64).reshape(10, 3)
+    palette = rgb2lab(palette / 255.0)
+    intra_dist = float(np.triu(_color_dist(palette[:, None], palette[None]), k=1).sum())
+
+    element._descriptors = _Descriptors(len(contours), hu_moments.reshape(-1, 7), palette, intra_dist)
+    return element._descriptors
+
+
+def _match_matrix(elements: list[Element]) -> np.ndarray:
+    matches = np.zeros((len(elements), len(elements)), dtype=bool)
+    valid = [i for i, element in enumerate(elements) if isinstance(element, Element)]
+    if not valid: return matches
+
+    descriptors = [_descriptors(elements[i]) for i in valid]
+
+    # Shapes match if the elements have as many contours and their Hu moments are nearly equal
+    contours = np.array([d.contours for d in descriptors])
+    shape_match = np.zeros((len(valid), len(valid)), dtype=bool)
+    for count in np.unique(contours):
+        group = np.flatnonzero(contours == count)
+        hu_moments = np.stack([descriptors[i].hu_moments for i in group])
+        diff = np.abs(hu_moments[:, None] - hu_moments[None]).sum(axis=(2, 3))
+        shape_match[np.ix_(group, group)] = diff < 1e-2
+
+    # Colors match if neither element is an empty cell of uniform color and their palettes are close
+    palettes = np.stack([d.palette for d in descriptors])
+    inter_dist = _color_dist(palettes[:, None], palettes[None]).sum(axis=-1)
+    textured = np.array([d.intra_dist / 10 >= 0.2 for d in descriptors])
+    color_match = textured[:, None] & textured[None] & (inter_dist / 10 <= 0.15)
+
+    matches[np.ix_(valid, valid)] = shape_match & color_match
     return matches
 
 
+@Metrics.timed("halligan_tool_seconds", tool="match")
 def match(e1: Element, e2: Element) -> bool: 
     """
     Check if two elements are visually similar or identical.
     Works best for grid items.
     """
-    if not (isinstance(e1, Element) and isinstance(e2, Element)):
-        return False
-    
-    def _moment_match():
-        img1 = np.array(e1.image)
-        img2 = np.array(e2.image)
-
-        gray1 = cv2.cvtColor(img1, cv2.COLOR_RGB2GRAY)
-        gray2 = cv2.cvtColor(img2, cv2.COLOR_RGB2GRAY)
-
-        _, threshold1 = cv2.threshold(gray1, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        _, threshold2 = cv2.threshold(gray2, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-
-        contours1, _ = cv2.findContours(threshold1, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
-        contours2, _ = cv2.findContours(threshold2, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
-
-        if len(contours1) != len(contours2): return False
-
-        contours1 = sorted(contours1, key=cv2.contourArea, reverse=True)
-        contours2 = sorted(contours2, key=cv2.contourArea, reverse=True)
- 
-        diff = 0.0
-        for contour1, contour2 in zip(contours1[1:], contours2[1:]):
-            moments1 = cv2.moments(contour1)
-            moments2 = cv2.moments(contour2)
-            hu_moments1 = cv2.HuMoments(moments1).flatten()
-            hu_moments2 = cv2.HuMoments(moments2).flatten()
-            diff += np.sum(np.abs(hu_moments1 - hu_moments2))
-    
-        return True if diff < 1e-2 else False
-    
-    def _color_match():
-        def _color_dist(c1, c2):
-            dist = deltaE_cie76(
-                rgb2lab([c / 255.0 for c in c1]), 
-                rgb2lab([c / 255.0 for c in c2])
-            )
-            dist = min(dist / 100.0, 1.0)
-            return dist
-
-        palette1 = e1.image.quantize(
-            colors=10, 
-            method=PIL.Image.Quantize.MEDIANCUT, 
-            dither=PIL.Image.Dither.NONE, 
-            kmeans=0
-        ).getpalette()
-    
-        palette2 = e2.image.quantize(
-            colors=10, 
-            method=PIL.Image.Quantize.MEDIANCUT, 
-            dither=PIL.Image.Dither.NONE, 
-            kmeans=0
-        ).getpalette()
-
-        palette1 = [palette1[i : i + 3] for i in range(0, 10 * 3, 3)]
-        palette2 = [palette2[i : i + 3] for i in range(0, 10 * 3, 3)]
-
-        intra_dist1 = sum([_color_dist(c1, c2) for c1, c2 in itertools.combinations(palette1, 2)])
-        intra_dist2 = sum([_color_dist(c1, c2) for c1, c2 in itertools.combinations(palette2, 2)])
-        inter_dist = sum([_color_dist(c1, c2) for c1, c2 in zip(palette1, palette2)])
+    return bool(_match_matrix([e1, e2])[0, 1])
 
-        # Reject empty cells of uniform color
-        if intra_dist1 / 10 < 0.2 or intra_dist2 / 10 < 0.2: return False
 
-        # Reject different colored cells
-        if inter_dist / 10 <= 0.15: return True
-
-    return _moment_match() and _color_match()
+@Metrics.timed("halligan_tool_seconds", tool="match_matrix")
+def match_matrix(elements: list[Element]) -> list[list[bool]]:
+    """
+    Check all pairs of elements at once, faster than calling `match` for each pair.
+    Returns matches (list[list[bool]]), where matches[i][j] is `match(elements[i], elements[j])`.
+    """
+    return _match_matrix(elements).tolist()
 
 
 dependencies = {**globals(), "__builtins__": __builtins__, "List": List}
 
 vision_toolkits: dict[str, Toolkit] = {
     "DRAGGABLE": [ask, rank, Frame.show_keypoints, Frame.get_keypoint, Point.show_neighbours, Point.get_neighbour],
-    "SWAPPABLE": [match, rank, Frame.get_interactable],
+    "SWAPPABLE": [match, match_matrix, rank, Frame.get_interactable],
     "SLIDEABLE_X": [rank, Frame.image, Frame.get_interactable],
     "SLIDEABLE_Y": [rank, Frame.image, Frame.get_interactable],
     "CLICKABLE": [mark, ask, compare, focus, Frame.image, Frame.get_interactable],
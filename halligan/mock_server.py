@@ -0,0 +1,245 @@
+"""
+A local OpenAI-compatible server that mocks the `/v1/chat/completions` subset used by GPTAgent.
+
+Responses are scripted (regex rules from a JSON file) or canned in the formats expected by
+each stage and vision tool, e.g. `answer(booleans=[...])` and `rank(ids=[...])`.
+Latency is drawn from a log-normal distribution, and rate limits (429) and timeouts can be injected.
+Streaming requests are answered with server-sent events, `--token-latency` paces the chunks.
+
+Usage:
+    python mock_server.py --port 8000 --latency 2.0 --sigma 0.5 --rate-limit 0.05
+    OPENAI_BASE_URL=http://localhost:8000/v1 python execute.py
+
+Script format (first matching rule wins, matched against the latest user prompt):
+    [{"pattern": "rank them based on", "response": "rank(ids=[2, 1, 0])"}]
+"""
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def canned_answer(answer_format: str, items: int, rng: random.Random) -> str:
+    """
+    Generate an `answer(...)` with one answer per image, `answer_format` is booleans, numbers or strings.
+    """
+    if answer_format == "numbers":
+        return f"answer(numbers={[rng.randint(0, 9) for _ in range(items)]})"
+    if answer_format == "strings":
+        return f"answer(strings={['a' for _ in range(items)]})"
+    return f"answer(booleans={[rng.random() < 0.5 for _ in range(items)]})"
+
+
+def canned_response(prompt: str, captions: list[str], rng: random.Random) -> str:
+    """
+    Generate a valid response for the prompt formats used by the stages and vision tools.
+    """
+    items = len([caption for caption in captions if caption != "Reference"])
+
+    # Merged questions of `ask_many`, answered one line per question about its own images
+    questions = re.findall(r'^Question (\d+): .*?following the format `answer\((\w+)=', prompt, re.MULTILINE | re.DOTALL)
+    if questions:
+        return "\n".join(
+            f"Question {q}: " + canned_answer(
+                answer_format, len([caption for caption in captions if caption.startswith(f"Question {q} ")]), rng
+            )
+            for q, answer_format in questions
+        )
+
+    if "rank(ids=" in prompt:
+        ids = list(range(items))
+        rng.shuffle(ids)
+        return f"rank(ids={ids})"
+    for answer_format in ("booleans", "numbers", "strings"):
+        if f"answer({answer_format}=" in prompt:
+            return canned_answer(answer_format, items, rng)
+    if "def structure_abstraction" in prompt:
+        return "```python\ndef structure_abstraction(frames):\n    pass\n```\nThis function sets up the frames."
+    if "Compose a Python script solution" in prompt or "Your code has errors" in prompt:
+        return "```python\ndef solve(frames):\n    pass\n```\nThis script solves the CAPTCHA."
+
+    return '```python\nobjective("Click the submit button.")\n```'
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        script: list[dict] = [],
+        latency: float = 0.0,
+        sigma: float = 0.0,
+        rate_limit: float = 0.0,
+        timeout_rate: float = 0.0,
+        timeout: float = 60.0,
+        token_latency: float = 0.0,
+        seed: int = None
+    ) -> None:
+        """
+        `latency`: median response latency (seconds), `sigma`: log-normal shape of the latency distribution.
+        `rate_limit`: probability of responding with 429.
+        `timeout_rate`: probability of stalling for `timeout` seconds before responding.
+        `token_latency`: delay (seconds) between streamed chunks of about one token.
+        """
+        super().__init__(address, MockHandler)
+        self.rules = [(re.compile(rule["pattern"]), rule["response"]) for rule in script]
+        self.latency = latency
+        self.sigma = sigma
+        self.rate_limit = rate_limit
+        self.timeout_rate = timeout_rate
+        self.timeout = timeout
+        self.token_latency = token_latency
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def sample(self) -> tuple[float, bool, bool]:
+        with self.lock:
+            self.requests += 1
+            delay = self.latency * self.rng.lognormvariate(0, self.sigma) if self.latency > 0 else 0.0
+            return delay, self.rng.random() < self.rate_limit, self.rng.random() < self.timeout_rate
+
+    def respond(self, prompt: str, captions: list[str]) -> str:
+        for pattern, response in self.rules:
+            if pattern.search(prompt): return response
+
+        with self.lock:
+            return canned_response(prompt, captions, self.rng)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server: MockServer
+
+    def send_json(self, status: int, body: dict, headers: dict = {}) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on the request (e.g. a cancelled hedge)
+            pass
+
+    def send_stream(self, chunk: dict, response: str, usage: dict) -> None:
+        """
+        Stream `response` as server-sent `chat.completion.chunk` events.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        # About one token per chunk
+        pieces = [response[i:i + 4] for i in range(0, len(response), 4)]
+        events = [{**chunk, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}]
+        events += [{**chunk, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]} for piece in pieces]
+        events += [{**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}]
+        if usage: events += [{**chunk, "choices": [], "usage": usage}]
+
+        try:
+            for event in events:
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                if self.server.token_latency: time.sleep(self.server.token_latency)
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading early
+            pass
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length))
+
+        delay, rate_limited, timed_out = self.server.sample()
+        if rate_limited:
+            self.send_json(429, {
+                "error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}
+            }, headers={"Retry-After": "1"})
+            return
+
+        time.sleep(self.server.timeout if timed_out else delay)
+
+        # The latest user turn holds the prompt, followed by (caption, image) pairs
+        message = [m for m in request["messages"] if m["role"] == "user"][-1]
+        content = message["content"]
+        if isinstance(content, str):
+            prompt, captions = content, []
+        else:
+            texts = [part["text"] for part in content if part["type"] == "text"]
+            prompt, captions = texts[0], texts[1:]
+
+        response = self.server.respond(prompt, captions)
+        prompt_tokens = sum(len(part.get("text", "")) // 4 + 765 * (part["type"] == "image_url") for part in content) \
+            if not isinstance(content, str) else len(content) // 4
+        completion_tokens = len(response) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+
+        if request.get("stream"):
+            include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+            self.send_stream({
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "system_fingerprint": "fp_mock"
+            }, response, usage if include_usage else None)
+            return
+
+        self.send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "system_fingerprint": "fp_mock",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": response},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible VLM server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--script", help="JSON file of {pattern, response} rules")
+    parser.add_argument("--latency", type=float, default=0.0, help="Median latency in seconds")
+    parser.add_argument("--sigma", type=float, default=0.0, help="Log-normal shape of the latency")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Probability of a 429 response")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="Probability of stalling a request")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Stall duration in seconds")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Delay between streamed chunks in seconds")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    script = json.load(open(args.script)) if args.script else []
+    server = MockServer(
+        (args.host, args.port), script,
+        latency=args.latency, sigma=args.sigma,
+        rate_limit=args.rate_limit, timeout_rate=args.timeout_rate, timeout=args.timeout,
+        token_latency=args.token_latency, seed=args.seed
+    )
+    print(f"Mock VLM server listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()